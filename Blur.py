@@ -0,0 +1,63 @@
+import math
+import numpy as np
+
+blurTemplate = """#version 330 core
+
+// generated by Blur.blurShaderSource, sigma {sigma}, radius {radius}
+const int taps = {taps};
+const float offsets[taps] = float[]({offsets});
+const float weights[taps] = float[]({weights});
+
+uniform sampler2D scene;
+uniform vec2 direction;
+// uv of the target scaled to the input, larger than 1 where the target pads the input
+uniform vec2 scale;
+
+in vec2 uv;
+out vec4 color_0;
+
+void main() {{
+    // direction is one texel along the blurred axis, pairs of kernel taps share one bilinear fetch
+    vec2 position = uv * scale;
+    vec3 color = textureLod(scene, position, 0).rgb * weights[0];
+    for (int i = 1; i < taps; i++) {{
+        color += textureLod(scene, position + offsets[i] * direction, 0).rgb * weights[i];
+        color += textureLod(scene, position - offsets[i] * direction, 0).rgb * weights[i];
+    }}
+
+    color_0 = vec4(color, 1.0);
+}}
+"""
+
+
+def blurRadius(sigma):
+    return max(1, int(math.ceil(3 * sigma)))
+
+
+def gaussianKernel(sigma, radius):
+    x = np.arange(-radius, radius + 1, dtype=np.float64)
+    k = np.exp(-x * x / (2 * sigma * sigma))
+    return k / k.sum()
+
+
+def gaussianTaps(sigma, radius):
+    k = gaussianKernel(sigma, radius)[radius:]
+
+    # merge the taps i and i + 1 into a single fetch between them, weighted by their share
+    offsets = [0.0]
+    weights = [k[0]]
+    for i in range(1, radius + 1, 2):
+        w1 = k[i]
+        w2 = k[i + 1] if i + 1 <= radius else 0.0
+        offsets.append((i * w1 + (i + 1) * w2) / (w1 + w2))
+        weights.append(w1 + w2)
+    return offsets, weights
+
+
+def blurShaderSource(sigma, radius=None):
+    if radius is None:
+        radius = blurRadius(sigma)
+    offsets, weights = gaussianTaps(sigma, radius)
+    return blurTemplate.format(sigma=sigma, radius=radius, taps=len(offsets),
+                               offsets=', '.join('%.8f' % o for o in offsets),
+                               weights=', '.join('%.8f' % w for w in weights))
@@ -0,0 +1,111 @@
+import os
+import numpy as np
+
+# Middlebury .flo magic number, 'PIEH' in little endian
+FLO_TAG = 202021.25
+
+
+def truncateNpy(path, frames):
+    # keeps the first frames of a .npy file that was sized from a frame count the input did not reach
+    # the memory map holds the file open, it is released on every path and before the file is replaced
+    data = np.load(path, mmap_mode='r')
+    try:
+        truncate = len(data) > frames
+        if truncate:
+            with open(path + '.tmp', 'wb') as npyFile:
+                np.save(npyFile, data[:frames])
+    finally:
+        del data
+    if truncate:
+        os.replace(path + '.tmp', path)
+
+
+def imageCoordinates(data, out):
+    # the flow of the render targets has rows bottom to top and y pointing up, outputs use the image convention
+    # of the input: rows top to bottom, vy pointing down and the angle mirrored with it
+    np.copyto(out, data[::-1])
+    out[..., 1] *= -1
+    out[..., 3] *= -1
+
+
+class NpyFlowWriter():
+    def __init__(self, path, width, height, frames, index=0, create=True):
+        # (frames, height, width, [vx, vy, r, angle]) in image coordinates, origin top left and y pointing down;
+        # shards of a sequence open the file created by the caller and write from their first frame on
+        self.path = path
+        self.create = create
+        if create:
+            self.flow = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(frames, height, width, 4))
+        else:
+            self.flow = np.lib.format.open_memmap(path, mode='r+')
+            assert (self.flow.shape == (frames, height, width, 4))
+        self.first = index
+        self.index = index
+
+    def write(self, data):
+        imageCoordinates(data, self.flow[self.index])
+        self.index += 1
+
+    def writeTile(self, index, x, y, data):
+        # part of frame index with its bottom left corner at (x, y) in texture coordinates
+        top = self.flow.shape[1] - y - data.shape[0]
+        imageCoordinates(data, self.flow[index, top:top + data.shape[0], x:x + data.shape[1]])
+        self.index = max(self.index, index + 1)
+
+    def close(self):
+        # an input that ended early leaves a shorter file, shards leave that to the caller
+        frames = len(self.flow)
+        self.flow.flush()
+        del self.flow
+        if self.create and self.index < frames:
+            truncateNpy(self.path, self.index)
+
+
+class FloFlowWriter():
+    def __init__(self, path, width, height, frames, index=0, create=True):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.first = index
+        self.index = index
+        os.makedirs(self.path, exist_ok=True)
+
+        self.header = np.array([FLO_TAG], dtype='<f4').tobytes() + np.array([width, height], dtype='<i4').tobytes()
+        self.uv = np.empty((height, width, 2), dtype='<f4')
+
+    def write(self, data):
+        # .flo has its origin in the top left corner with v pointing downwards
+        np.copyto(self.uv[..., 0], data[::-1, :, 0])
+        np.negative(data[::-1, :, 1], out=self.uv[..., 1])
+        with open(os.path.join(self.path, 'frame_%06d.flo' % self.index), 'wb') as floFile:
+            floFile.write(self.header)
+            floFile.write(self.uv.tobytes())
+        self.index += 1
+
+    def close(self):
+        pass
+
+
+class TrackWriter():
+    def __init__(self, path, points, frames):
+        # (frames, points, [x, y, vx, vy, id]), NaN where a slot holds no track
+        self.path = path
+        self.tracks = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(frames, points, 5))
+        self.index = 0
+
+    def write(self, tracks):
+        self.tracks[self.index] = tracks
+        self.index += 1
+
+    def close(self):
+        frames = len(self.tracks)
+        self.tracks.flush()
+        del self.tracks
+        if self.index < frames:
+            truncateNpy(self.path, self.index)
+
+
+def createFlowWriter(path, width, height, frames, index=0, create=True):
+    if path.endswith('.npy'):
+        return NpyFlowWriter(path, width, height, frames, index, create)
+    return FloFlowWriter(path, width, height, frames, index, create)
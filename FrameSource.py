@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import queue
+import traceback
+import shutil
+import subprocess
+import multiprocessing
+from multiprocessing import shared_memory
+from os.path import isdir, isfile, join
+import numpy as np
+import matplotlib.pyplot as plt
+
+# frames are handed out as (height, width, 3) uint8 arrays with the rows in texture order (bottom row first)
+
+
+class ImageSource():
+    # still images of a directory, sorted by name, every frame can be read directly
+    sequential = False
+
+    def __init__(self, path):
+        self.path = path
+        self.files = sorted(f for f in os.listdir(path) if isfile(join(path, f)))
+        self.frameCount = len(self.files)
+        self.width, self.height = 0, 0
+        if self.files:
+            image = plt.imread(join(path, self.files[0]))
+            self.height, self.width = image.shape[:2]
+
+    def read(self, index, out):
+        if index >= self.frameCount:
+            return False
+        image = plt.imread(join(self.path, self.files[index]))
+        if image.dtype != np.uint8:
+            image = (image * 255.0 + 0.5).astype(np.uint8)
+        if image.ndim == 2:
+            image = image[:, :, None]
+        np.copyto(out, image[::-1, :, :3])
+        return True
+
+    def close(self):
+        pass
+
+
+class FfmpegSource():
+    # video decoded by an ffmpeg process writing raw rgb24 frames to a pipe
+    sequential = True
+    # gaps up to this many frames are decoded and dropped instead of restarting ffmpeg at a new position
+    seekDistance = 32
+
+    def __init__(self, path):
+        self.path = path
+        probe = subprocess.run(['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-of', 'json', '-show_entries',
+                                'stream=width,height,avg_frame_rate,nb_frames,duration', path],
+                               stdout=subprocess.PIPE, check=True)
+        stream = json.loads(probe.stdout)['streams'][0]
+        self.width, self.height = int(stream['width']), int(stream['height'])
+        numerator, denominator = stream.get('avg_frame_rate', '0/1').split('/')
+        self.fps = float(numerator) / max(float(denominator), 1.0)
+        if stream.get('nb_frames', 'N/A') != 'N/A':
+            self.frameCount = int(stream['nb_frames'])
+        else:
+            # containers without a frame count, estimated from the duration
+            self.frameCount = int(round(float(stream.get('duration', 0)) * self.fps))
+        self.process = None
+        self.position = 0
+        self.scratch = np.empty((self.height, self.width, 3), dtype=np.uint8)
+
+    def seek(self, index):
+        self.close()
+        # -ss before -i seeks to the preceding keyframe and decodes up to the exact frame
+        self.process = subprocess.Popen(['ffmpeg', '-v', 'error', '-nostdin', '-ss', '%.6f' % (index / self.fps),
+                                         '-i', self.path, '-map', '0:v:0', '-vf', 'vflip', '-f', 'rawvideo',
+                                         '-pix_fmt', 'rgb24', '-'],
+                                        stdout=subprocess.PIPE, bufsize=self.width * self.height * 3)
+        self.position = index
+
+    def readNext(self, out):
+        view = memoryview(out).cast('B')
+        filled = 0
+        while filled < len(view):
+            count = self.process.stdout.readinto(view[filled:])
+            if not count:
+                return False
+            filled += count
+        self.position += 1
+        return True
+
+    def read(self, index, out):
+        if self.process is None or index < self.position or index - self.position > self.seekDistance:
+            self.seek(index)
+        while self.position < index:
+            if not self.readNext(self.scratch):
+                return False
+        return self.readNext(out)
+
+    def close(self):
+        if self.process is not None:
+            self.process.stdout.close()
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+
+class ImageioSource():
+    # video decoded through imageio, used when the ffmpeg executable is not on the path
+    sequential = True
+
+    def __init__(self, path):
+        import imageio
+        self.reader = imageio.get_reader(path)
+        metadata = self.reader.get_meta_data()
+        self.width, self.height = metadata['size']
+        self.frameCount = self.reader.count_frames()
+        self.position = None
+
+    def read(self, index, out):
+        if index >= self.frameCount:
+            return False
+        try:
+            image = self.reader.get_next_data() if index == self.position else self.reader.get_data(index)
+        except (IndexError, StopIteration):
+            return False
+        np.copyto(out, image[::-1, :, :3])
+        self.position = index + 1
+        return True
+
+    def close(self):
+        self.reader.close()
+
+
+def createFrameSource(path):
+    # a missing path would otherwise surface as an ffprobe or imageio error
+    if not os.path.exists(path):
+        raise FileNotFoundError('no image directory or video at %s' % path)
+    if isdir(path):
+        return ImageSource(path)
+    if shutil.which('ffmpeg') and shutil.which('ffprobe'):
+        return FfmpegSource(path)
+    try:
+        return ImageioSource(path)
+    except ImportError:
+        raise RuntimeError('decoding %s needs ffmpeg on the path or imageio' % path)
+
+
+def decodeFrames(path, indices, memory, slots, shape, free, filled):
+    # runs in the decoder process, fills the shared slots in the order of indices; None marks the end of the source,
+    # a string the traceback of a failed read that is raised again in the parent
+    frames = np.ndarray((slots,) + shape, dtype=np.uint8, buffer=memory.buf)
+    source = None
+    try:
+        source = createFrameSource(path)
+        for index in indices:
+            slot = free.get()
+            if slot is None:
+                break
+            start = time.perf_counter()
+            if not source.read(index, frames[slot]):
+                break
+            filled.put((slot, time.perf_counter() - start))
+    except Exception:
+        filled.put(traceback.format_exc())
+    finally:
+        if source is not None:
+            source.close()
+        del frames
+        filled.put(None)
+
+
+class FrameDecoder():
+    # decoder process with a ring of frames in shared memory, slots travel between the free and filled queues
+    def __init__(self, path, indices, shape, slots):
+        self.path = path
+        self.slots = slots
+        self.memory = shared_memory.SharedMemory(create=True, size=slots * int(np.prod(shape)))
+        self.frames = np.ndarray((slots,) + shape, dtype=np.uint8, buffer=self.memory.buf)
+        self.free = multiprocessing.Queue()
+        self.filled = multiprocessing.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+        self.process = multiprocessing.Process(target=decodeFrames, daemon=True,
+                                               args=(path, indices, self.memory, slots, shape, self.free, self.filled))
+        self.process.start()
+
+    def ready(self):
+        return not self.filled.empty()
+
+    def get(self):
+        # (slot, decode time) of the next frame, None at the end of the source
+        while True:
+            try:
+                frame = self.filled.get(timeout=1.0)
+                break
+            except queue.Empty:
+                if not self.process.is_alive() and self.filled.empty():
+                    raise RuntimeError('decoder process of %s exited with code %s' % (self.path, self.process.exitcode))
+        if isinstance(frame, str):
+            raise RuntimeError('decoding %s failed\n%s' % (self.path, frame))
+        return frame
+
+    def release(self, slot):
+        self.free.put(slot)
+
+    def close(self):
+        self.free.put(None)
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        del self.frames
+        self.memory.close()
+        self.memory.unlink()
@@ -1,8 +1,11 @@
+import os
 import glfw
+import hashlib
 import math
 import numpy as np
 from OpenGL.GL import *
 import OpenGL.GL.shaders
+import OpenGL.images
 
 def vec3(x, y, z):
     return np.array([x, y, z], dtype=np.float32)
@@ -63,75 +66,415 @@ def rotationMatrixZ(angle):
 
 identityMat = np.eye(4)
 
+pixelChannels = {GL_RED: 1, GL_RG: 2, GL_RGB: 3, GL_RGBA: 4}
+# PyOpenGL does not size GL_RG pixel transfers by itself
+OpenGL.images.COMPONENT_COUNTS.setdefault(GL_RG, 2)
+
+# internal format: (pixel format, pixel type) used to specify the texture
+textureFormats = {
+    GL_RGB: (GL_RGB, GL_FLOAT),
+    GL_RGB8: (GL_RGB, GL_UNSIGNED_BYTE),
+    GL_RGBA8: (GL_RGBA, GL_UNSIGNED_BYTE),
+    GL_R16F: (GL_RED, GL_HALF_FLOAT),
+    GL_RG16F: (GL_RG, GL_HALF_FLOAT),
+    GL_RGBA16F: (GL_RGBA, GL_HALF_FLOAT),
+    GL_R32F: (GL_RED, GL_FLOAT),
+    GL_RG32F: (GL_RG, GL_FLOAT),
+    GL_RGBA32F: (GL_RGBA, GL_FLOAT),
+}
+
+# bytes per texel as allocated by the driver, RGB8 is padded to four bytes
+textureBytes = {
+    GL_RGB: 4, GL_RGB8: 4, GL_RGBA8: 4,
+    GL_R16F: 2, GL_RG16F: 4, GL_RGBA16F: 8,
+    GL_R32F: 4, GL_RG32F: 8, GL_RGBA32F: 16,
+    GL_DEPTH_COMPONENT32: 4,
+}
+
+# uniform buffer binding of the Transform block declared by the vertex shaders
+transformBinding = 0
+
+
+# fragment shaders of layered programs sample texture arrays, at the layer the geometry shader routed the primitive to
+layeredFragment = """#define sampler2D sampler2DArray
+#define textureLod(image, uv, lod) textureLod(image, vec3(uv, layer), lod)
+flat in int layer;
+"""
+
+
+def defineShader(source, defines, fragment=False):
+    # specializes a shader, the defines are inserted right after the #version line
+    if not defines:
+        return source
+    version, body = source.split('\n', 1)
+    header = ''.join('#define %s\n' % define for define in defines)
+    if fragment and 'LAYERED' in defines:
+        header += layeredFragment
+    return version + '\n' + header + body
+
+# allocated texture memory in bytes, current and peak
+textureMemory = {'current': 0, 'peak': 0}
+
+def trackTextureMemory(size):
+    textureMemory['current'] += size
+    textureMemory['peak'] = max(textureMemory['peak'], textureMemory['current'])
+
 
 class GLContext:
     window = None
 
-    def __init__(self, width=512, height=512):
-        if not glfw.init():
-            return
+    egl_display = None
 
-        glfw.window_hint(glfw.SAMPLES, 4);
-        glfw.window_hint(glfw.RESIZABLE, GL_FALSE);
-        glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 3);
-        glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 3);
-        glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE);
+    def __init__(self, width=512, height=512, visible=True, shaderCache='.shader_cache'):
+        if not visible and os.environ.get('PYOPENGL_PLATFORM') == 'egl':
+            # offscreen context without any window system, e.g. Mesa llvmpipe on render nodes
+            self.createEGLContext()
+            # without a surface the viewport is not initialized to the frame size
+            glViewport(0, 0, width, height)
+        else:
+            if not glfw.init():
+                return
 
-        self.window = glfw.create_window(width, height, "-", None, None)
+            glfw.window_hint(glfw.SAMPLES, 4);
+            glfw.window_hint(glfw.RESIZABLE, GL_FALSE);
+            glfw.window_hint(glfw.VISIBLE, GL_TRUE if visible else GL_FALSE);
+            glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 3);
+            glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 3);
+            glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE);
 
-        if not self.window:
-            glfw.terminate()
-            return
+            self.window = glfw.create_window(width, height, "-", None, None)
+
+            if not self.window:
+                glfw.terminate()
+                return
 
-        glfw.make_context_current(self.window)
+            glfw.make_context_current(self.window)
 
         # OpenGL settings
         glEnable(GL_CULL_FACE)
         glDepthFunc(GL_LESS)
 
-    def createShader(self, vsFilename, fsFilename):
+        self.programs = ProgramCache(shaderCache)
+        self.transforms = TransformBuffer()
+
+    def createEGLContext(self):
+        from OpenGL import EGL
+
+        # no default framebuffer is needed, all passes render into framebuffer objects
+        os.environ.setdefault('EGL_PLATFORM', 'surfaceless')
+        self.egl_display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        if not EGL.eglInitialize(self.egl_display, None, None):
+            raise RuntimeError('could not initialize EGL display')
+
+        config = EGL.EGLConfig()
+        num_configs = EGL.EGLint()
+        config_attributes = (EGL.EGLint * 5)(EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+                                             EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT, EGL.EGL_NONE)
+        EGL.eglChooseConfig(self.egl_display, config_attributes, ctypes.pointer(config), 1, ctypes.pointer(num_configs))
+        if num_configs.value < 1:
+            raise RuntimeError('no EGL config with desktop OpenGL support')
+
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        context_attributes = (EGL.EGLint * 7)(EGL.EGL_CONTEXT_MAJOR_VERSION, 3, EGL.EGL_CONTEXT_MINOR_VERSION, 3,
+                                              EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK, EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT,
+                                              EGL.EGL_NONE)
+        self.egl_context = EGL.eglCreateContext(self.egl_display, config, EGL.EGL_NO_CONTEXT, context_attributes)
+        if not self.egl_context:
+            raise RuntimeError('could not create EGL context')
+        EGL.eglMakeCurrent(self.egl_display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, self.egl_context)
+
+    def terminate(self):
+        if self.egl_display is not None:
+            from OpenGL import EGL
+            EGL.eglMakeCurrent(self.egl_display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+            EGL.eglDestroyContext(self.egl_display, self.egl_context)
+            EGL.eglTerminate(self.egl_display)
+            self.egl_display = None
+        else:
+            glfw.terminate()
+
+    def createShader(self, vsFilename, fsFilename, gsFilename=None, defines=()):
         with open(vsFilename, 'r') as vsFile:
             vsString = vsFile.read()
 
-        vs = OpenGL.GL.shaders.compileShader(vsString, GL_VERTEX_SHADER)
-
         with open(fsFilename, 'r') as fsFile:
             fsString = fsFile.read()
-        fs = OpenGL.GL.shaders.compileShader(fsString, GL_FRAGMENT_SHADER)
 
-        sp = OpenGL.GL.shaders.compileProgram(vs, fs)
-        return sp
+        gsString = None
+        if gsFilename is not None:
+            with open(gsFilename, 'r') as gsFile:
+                gsString = gsFile.read()
+
+        return self.createShaderFromSource(vsString, fsString, gsString, defines)
+
+    def createShaderFromSource(self, vsString, fsString, gsString=None, defines=()):
+        vsString = defineShader(vsString, defines)
+        fsString = defineShader(fsString, defines, fragment=True)
+        gsString = defineShader(gsString, defines) if gsString is not None else None
+        return self.programs.program(vsString, fsString, gsString)
+
+    def uniformLocation(self, program, name):
+        return self.programs.uniformLocation(program, name)
+
+
+class ProgramCache():
+    # linked programs keyed by a hash of their sources, the binaries are kept on disk so warm starts skip compilation
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.programs = {}
+        self.locations = {}
+        # binaries are only valid for the driver that produced them
+        self.driver = b'\0'.join(glGetString(name) for name in (GL_VENDOR, GL_RENDERER, GL_VERSION))
+        self.binaries = glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS) > 0
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, vsString, fsString, gsString=None):
+        digest = hashlib.sha1(self.driver)
+        for source in (vsString, fsString, gsString):
+            if source is not None:
+                digest.update(b'\0')
+                digest.update(source.encode())
+        return digest.hexdigest()
+
+    def program(self, vsString, fsString, gsString=None):
+        key = self.key(vsString, fsString, gsString)
+        if key in self.programs:
+            return self.programs[key]
+
+        program = self.loadBinary(key)
+        if program is None:
+            program = self.link(vsString, fsString, gsString)
+            self.storeBinary(key, program)
+
+        block = glGetUniformBlockIndex(program, 'Transform')
+        if block != GL_INVALID_INDEX:
+            glUniformBlockBinding(program, block, transformBinding)
+        self.programs[key] = program
+        return program
+
+    def link(self, vsString, fsString, gsString=None):
+        shaders = [OpenGL.GL.shaders.compileShader(vsString, GL_VERTEX_SHADER),
+                   OpenGL.GL.shaders.compileShader(fsString, GL_FRAGMENT_SHADER)]
+        if gsString is not None:
+            shaders.append(OpenGL.GL.shaders.compileShader(gsString, GL_GEOMETRY_SHADER))
+        program = glCreateProgram()
+        for shader in shaders:
+            glAttachShader(program, shader)
+        if self.binaries:
+            glProgramParameteri(program, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+        glLinkProgram(program)
+        for shader in shaders:
+            glDetachShader(program, shader)
+            glDeleteShader(shader)
+        if glGetProgramiv(program, GL_LINK_STATUS) != GL_TRUE:
+            raise RuntimeError('link failure (%s)' % glGetProgramInfoLog(program))
+        return program
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.bin')
+
+    def loadBinary(self, key):
+        if not self.directory or not self.binaries or not os.path.exists(self.path(key)):
+            return None
+        with open(self.path(key), 'rb') as binaryFile:
+            binaryFormat = int(np.frombuffer(binaryFile.read(4), dtype='<u4')[0])
+            binary = binaryFile.read()
+        program = glCreateProgram()
+        glProgramBinary(program, binaryFormat, binary, len(binary))
+        if glGetProgramiv(program, GL_LINK_STATUS) != GL_TRUE:
+            # rejected by the driver, e.g. after an update, compile again and replace it
+            glDeleteProgram(program)
+            return None
+        return program
+
+    def storeBinary(self, key, program):
+        if not self.directory or not self.binaries:
+            return
+        size = glGetProgramiv(program, GL_PROGRAM_BINARY_LENGTH)
+        if size <= 0:
+            return
+        binary = (ctypes.c_ubyte * size)()
+        length = GLsizei()
+        binaryFormat = GLenum()
+        glGetProgramBinary(program, size, ctypes.byref(length), ctypes.byref(binaryFormat), binary)
+        # written next to the final file and renamed, so concurrent runs never read a partial binary
+        temporary = '%s.%d' % (self.path(key), os.getpid())
+        with open(temporary, 'wb') as binaryFile:
+            binaryFile.write(np.array([binaryFormat.value], dtype='<u4').tobytes())
+            binaryFile.write(bytes(binary)[:length.value])
+        os.replace(temporary, self.path(key))
+
+    def uniformLocation(self, program, name):
+        key = (program, name)
+        if key not in self.locations:
+            self.locations[key] = glGetUniformLocation(program, name)
+        return self.locations[key]
+
+
+class TransformBuffer():
+    # model matrices of all draws in one uniform buffer, a draw binds its slot instead of uploading a matrix
+    def __init__(self, capacity=16):
+        alignment = int(glGetIntegerv(GL_UNIFORM_BUFFER_OFFSET_ALIGNMENT))
+        self.stride = (64 + alignment - 1) // alignment * alignment
+        self.matrices = []
+        self.capacity = 0
+        self.ubo = glGenBuffers(1)
+        self.allocate(capacity)
+        # slot 0 is the identity of full screen passes
+        self.identity = self.add(identityMat)
+
+    def allocate(self, capacity):
+        self.capacity = capacity
+        glBindBuffer(GL_UNIFORM_BUFFER, self.ubo)
+        glBufferData(GL_UNIFORM_BUFFER, self.capacity * self.stride, None, GL_STATIC_DRAW)
+        for slot, matrix in enumerate(self.matrices):
+            glBufferSubData(GL_UNIFORM_BUFFER, slot * self.stride, matrix.nbytes, matrix)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+
+    def add(self, matrix):
+        # std140 matrices are column major
+        matrix = np.ascontiguousarray(np.asarray(matrix, dtype=np.float32).T)
+        for slot, stored in enumerate(self.matrices):
+            if np.array_equal(stored, matrix):
+                return slot
+        self.matrices.append(matrix)
+        if len(self.matrices) > self.capacity:
+            self.allocate(2 * self.capacity)
+        else:
+            glBindBuffer(GL_UNIFORM_BUFFER, self.ubo)
+            glBufferSubData(GL_UNIFORM_BUFFER, (len(self.matrices) - 1) * self.stride, matrix.nbytes, matrix)
+            glBindBuffer(GL_UNIFORM_BUFFER, 0)
+        return len(self.matrices) - 1
+
+    def bind(self, slot):
+        glBindBufferRange(GL_UNIFORM_BUFFER, transformBinding, self.ubo, slot * self.stride, 64)
 
 class Texture():
-    def __init__(self, width, height, data=None):
+    def __init__(self, width, height, data=None, internalFormat=GL_RGB, layers=1):
         self.width = width
         self.height = height
+        # more than one layer makes a texture array, one layer per stream of a batch
+        self.layers = layers
+        self.target = GL_TEXTURE_2D_ARRAY if layers > 1 else GL_TEXTURE_2D
+        self.internalFormat = internalFormat
+        self.format, self.type = textureFormats[internalFormat]
         self.texture = glGenTextures(1)
         self.setData(data)
+        # full mipmap chain
+        self.memory = width * height * layers * textureBytes[internalFormat] * 4 // 3
+        trackTextureMemory(self.memory)
 
     def setData(self, data):
-        glBindTexture(GL_TEXTURE_2D, self.texture)
-        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGB, self.width, self.height, 0, GL_RGB, GL_FLOAT, data)
-        glGenerateMipmap(GL_TEXTURE_2D)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-        glBindTexture(GL_TEXTURE_2D, 0)
+        type = GL_UNSIGNED_BYTE if data is not None and data.dtype == np.uint8 else self.type
+        glBindTexture(self.target, self.texture)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        if self.layers > 1:
+            glTexImage3D(self.target, 0, self.internalFormat, self.width, self.height, self.layers, 0, self.format, type, data)
+        else:
+            glTexImage2D(self.target, 0, self.internalFormat, self.width, self.height, 0, self.format, type, data)
+        glGenerateMipmap(self.target)
+        glTexParameteri(self.target, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
+        glTexParameteri(self.target, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glBindTexture(self.target, 0)
+
+    def setWrap(self, wrap):
+        glBindTexture(self.target, self.texture)
+        glTexParameteri(self.target, GL_TEXTURE_WRAP_S, wrap)
+        glTexParameteri(self.target, GL_TEXTURE_WRAP_T, wrap)
+        glBindTexture(self.target, 0)
+
+    def getBuffer(self, format=GL_RGBA):
+        channels = pixelChannels[format]
+        glBindTexture(self.target, self.texture)
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        buf = glGetTexImage(self.target, 0, format, GL_FLOAT)
+        glBindTexture(self.target, 0)
+        shape = (self.height, self.width, channels)
+        return np.frombuffer(buf, np.float32).reshape((self.layers,) + shape if self.layers > 1 else shape)
 
-    def getBuffer(self):
-        glBindTexture(GL_TEXTURE_2D, self.texture)
-        buf = glGetTexImage(GL_TEXTURE_2D, 0, GL_RGB, GL_FLOAT)
-        glBindTexture(GL_TEXTURE_2D, 0)
-        buf = np.frombuffer(buf, np.float32).reshape((self.width, self.height, 4))
-        buf[:,:,3] = 1
-        return buf
+    def deleteTexture(self):
+        trackTextureMemory(-self.memory)
+        glBindTexture(self.target, self.texture)
+        glDeleteTextures(1, self.texture)
+        glBindTexture(self.target, 0)
+
+class StreamingTexture():
+    # storage is allocated once, frames are uploaded as uint8 through two alternating pixel unpack buffers
+    def __init__(self, width, height, mipmaps=False, layers=1):
+        self.width = width
+        self.height = height
+        self.mipmaps = mipmaps
+        # with more than one layer, a frame of every stream of a batch is uploaded at once into a texture array
+        self.layers = layers
+        self.target = GL_TEXTURE_2D_ARRAY if layers > 1 else GL_TEXTURE_2D
+        self.levels = int(math.log2(max(width, height))) + 1 if mipmaps else 1
+        self.frameSize = width * height * 3
+        self.size = self.frameSize * layers
+        self.memory = width * height * layers * textureBytes[GL_RGB8]
+        if mipmaps:
+            self.memory = self.memory * 4 // 3
+        trackTextureMemory(self.memory)
+
+        self.texture = glGenTextures(1)
+        glBindTexture(self.target, self.texture)
+        if layers > 1:
+            glTexStorage3D(self.target, self.levels, GL_RGB8, width, height, layers)
+        elif bool(glTexStorage2D):
+            glTexStorage2D(self.target, self.levels, GL_RGB8, width, height)
+        else:
+            for level in range(self.levels):
+                glTexImage2D(self.target, level, GL_RGB8, max(1, width >> level), max(1, height >> level), 0,
+                             GL_RGB, GL_UNSIGNED_BYTE, None)
+            glTexParameteri(self.target, GL_TEXTURE_MAX_LEVEL, self.levels - 1)
+        glTexParameteri(self.target, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR if mipmaps else GL_LINEAR)
+        glTexParameteri(self.target, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexParameteri(self.target, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(self.target, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glBindTexture(self.target, 0)
+
+        self.pbos = [glGenBuffers(1) for i in range(2)]
+        for pbo in self.pbos:
+            glBindBuffer(GL_PIXEL_UNPACK_BUFFER, pbo)
+            glBufferData(GL_PIXEL_UNPACK_BUFFER, self.size, None, GL_STREAM_DRAW)
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+        self.index = 0
+
+    def setData(self, data):
+        # one frame, or a sequence of one frame per layer
+        frames = [data] if self.layers == 1 else data
+        assert (len(frames) == self.layers)
+
+        # the copy into one buffer does not wait for the transfer still reading from the other one
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, self.pbos[self.index])
+        pointer = glMapBufferRange(GL_PIXEL_UNPACK_BUFFER, 0, self.size, GL_MAP_WRITE_BIT | GL_MAP_INVALIDATE_BUFFER_BIT)
+        for layer, frame in enumerate(frames):
+            assert (frame.dtype == np.uint8 and frame.shape == (self.height, self.width, 3))
+            frame = np.ascontiguousarray(frame)
+            ctypes.memmove(pointer + layer * self.frameSize, frame.ctypes.data, self.frameSize)
+        glUnmapBuffer(GL_PIXEL_UNPACK_BUFFER)
+        self.index = (self.index + 1) % len(self.pbos)
+
+        glBindTexture(self.target, self.texture)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        if self.layers > 1:
+            glTexSubImage3D(self.target, 0, 0, 0, 0, self.width, self.height, self.layers, GL_RGB, GL_UNSIGNED_BYTE,
+                            ctypes.c_void_p(0))
+        else:
+            glTexSubImage2D(self.target, 0, 0, 0, self.width, self.height, GL_RGB, GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        if self.mipmaps:
+            glGenerateMipmap(self.target)
+        glBindTexture(self.target, 0)
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
 
     def deleteTexture(self):
-        glBindTexture(GL_TEXTURE_2D, self.texture)
+        trackTextureMemory(-self.memory)
+        glDeleteBuffers(len(self.pbos), self.pbos)
         glDeleteTextures(1, self.texture)
-        glBindTexture(GL_TEXTURE_2D, 0)
 
 class DepthTexture():
     def __init__(self, width, height, data=None):
+        trackTextureMemory(width * height * textureBytes[GL_DEPTH_COMPONENT32])
         self.texture = glGenTextures(1)
         glBindTexture(GL_TEXTURE_2D, self.texture)
         glTexImage2D(GL_TEXTURE_2D, 0, GL_DEPTH_COMPONENT32, width, height, 0, GL_DEPTH_COMPONENT,
@@ -141,25 +484,44 @@ class DepthTexture():
         glBindTexture(GL_TEXTURE_2D, 0)
 
 class FrameBuffer():
-    def __init__(self, width, height, attachments=1, clear_color=np.array([0.0, 0.0, 0.0, 1.0], dtype=np.float32), default=False):
+    def __init__(self, width, height, attachments=1, clear_color=np.array([0.0, 0.0, 0.0, 1.0], dtype=np.float32), default=False, formats=None, depth=False, layers=1,
+                 textures=None):
+        # textures attaches existing Texture objects instead of allocating one per format
+        if textures is not None:
+            formats = [texture.internalFormat for texture in textures]
+        if formats is None:
+            formats = [GL_RGB] * attachments
         self.clear_color = clear_color
+        self.width = width
+        self.height = height
+        self.formats = formats
+        # layered framebuffers render into texture arrays, the geometry shader picks the layer of every primitive
+        self.layers = layers
+        self.target = GL_TEXTURE_2D_ARRAY if layers > 1 else GL_TEXTURE_2D
+        assert (layers == 1 or not depth)
 
         self.fb = 0
+        self.depth_buffer = None
         if not default:
             self.fb = glGenFramebuffers(1)
 
             glBindFramebuffer(GL_FRAMEBUFFER, self.fb)
             self.color_buffer_textures = []
             self.color_buffers = []
-            for i in range(attachments):
-                texture = Texture(width, height)
+            for i in range(len(formats)):
+                texture = textures[i] if textures is not None else Texture(width, height, internalFormat=formats[i], layers=layers)
                 self.color_buffer_textures.append(texture)
                 self.color_buffers.append(GL_COLOR_ATTACHMENT0 + i)
-                glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0 + i, GL_TEXTURE_2D, self.color_buffer_textures[i].texture, 0)
+                if layers > 1:
+                    glFramebufferTexture(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0 + i, texture.texture, 0)
+                else:
+                    glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0 + i, GL_TEXTURE_2D, texture.texture, 0)
             glDrawBuffers(len(self.color_buffers), self.color_buffers)
 
-            self.depth_buffer = DepthTexture(width, height)
-            glFramebufferTexture2D(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_TEXTURE_2D, self.depth_buffer.texture, 0)
+            # depth test is disabled for all image passes, only attach a depth buffer on request
+            if depth:
+                self.depth_buffer = DepthTexture(width, height)
+                glFramebufferTexture2D(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_TEXTURE_2D, self.depth_buffer.texture, 0)
             glBindFramebuffer(GL_FRAMEBUFFER, 0)
 
     def getTexture(self, i):
@@ -169,78 +531,138 @@ class FrameBuffer():
         for i in range(len(color_buffer)):
             assert (i < 16)
             glActiveTexture(GL_TEXTURE0 + i)
-            glBindTexture(GL_TEXTURE_2D, color_buffer[i])
+            glBindTexture(self.target, color_buffer[i])
             if mipmaps:
-                glGenerateMipmap(GL_TEXTURE_2D)
+                glGenerateMipmap(self.target)
 
     def unbindTextures(self, color_buffer):
         for i in range(len(color_buffer)):
             assert (i < 16)
             glActiveTexture(GL_TEXTURE0 + i)
-            glBindTexture(GL_TEXTURE_2D, 0)
+            glBindTexture(self.target, 0)
 
     def init(self, color_buffer=[], clear=True, mipmaps=False):
         glBindFramebuffer(GL_FRAMEBUFFER, self.fb)
+        glViewport(0, 0, self.width, self.height)
         if clear:
             glClearColor(self.clear_color[0], self.clear_color[1], self.clear_color[2], self.clear_color[3])
             glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
         self.bindTextures(color_buffer, mipmaps)
 
+class FrameHistory():
+    # ring of framebuffers, advancing a frame only moves the head so no frame is ever copied
+    def __init__(self, width, height, depth=2, formats=None, layers=1):
+        self.frames = [FrameBuffer(width=width, height=height, formats=formats, layers=layers) for i in range(depth)]
+        for frame in self.frames:
+            for texture in frame.color_buffer_textures:
+                texture.setWrap(GL_CLAMP_TO_EDGE)
+        self.head = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def rotate(self):
+        self.head = (self.head + 1) % len(self.frames)
+
+    def get(self, age=0):
+        # age 0 is the current frame, age i the frame i steps back
+        return self.frames[(self.head - age) % len(self.frames)]
+
+class PixelReadback():
+    # ring of pixel pack buffers, frame N is copied on the GPU while frame N - 1 is mapped on the CPU
+    def __init__(self, width, height, depth=3, format=GL_RGBA, layers=1):
+        assert (depth >= 2)
+        self.width = width
+        self.height = height
+        self.layers = layers
+        self.format = format
+        self.channels = pixelChannels[format]
+        self.size = width * height * layers * self.channels * np.dtype(np.float32).itemsize
+
+        self.pbos = [glGenBuffers(1) for i in range(depth)]
+        self.fences = [None] * depth
+        for pbo in self.pbos:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, pbo)
+            glBufferData(GL_PIXEL_PACK_BUFFER, self.size, None, GL_STREAM_READ)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+        self.head = 0
+        self.pending = 0
+
+    def full(self):
+        return self.pending == len(self.pbos)
+
+    def empty(self):
+        return self.pending == 0
+
+    def push(self, framebuffer, attachment):
+        if self.layers > 1:
+            # all layers of the attachment in one copy
+            self.pushTexture(framebuffer.getTexture(attachment))
+            return
+        assert (not self.full())
+        slot = self.head % len(self.pbos)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.pbos[slot])
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, framebuffer.fb)
+        glReadBuffer(GL_COLOR_ATTACHMENT0 + attachment)
+        glReadPixels(0, 0, self.width, self.height, self.format, GL_FLOAT, ctypes.c_void_p(0))
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, 0)
+        self.fence(slot)
+
+    def pushTexture(self, texture):
+        # level 0 of a texture of the readback size, also one that is not attached to any framebuffer
+        assert (not self.full())
+        slot = self.head % len(self.pbos)
+        target = GL_TEXTURE_2D_ARRAY if self.layers > 1 else GL_TEXTURE_2D
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.pbos[slot])
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        glBindTexture(target, texture)
+        glGetTexImage(target, 0, self.format, GL_FLOAT, ctypes.c_void_p(0))
+        glBindTexture(target, 0)
+        self.fence(slot)
+
+    def fence(self, slot):
+        self.fences[slot] = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self.head += 1
+        self.pending += 1
+
+    def map(self):
+        # zero-copy view of the oldest pending frame, valid until unmap()
+        assert (not self.empty())
+        slot = (self.head - self.pending) % len(self.pbos)
+        glClientWaitSync(self.fences[slot], GL_SYNC_FLUSH_COMMANDS_BIT, GL_TIMEOUT_IGNORED)
+        glDeleteSync(self.fences[slot])
+        self.fences[slot] = None
+
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.pbos[slot])
+        pointer = glMapBufferRange(GL_PIXEL_PACK_BUFFER, 0, self.size, GL_MAP_READ_BIT)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        pointer = ctypes.cast(pointer, ctypes.POINTER(ctypes.c_float))
+        shape = (self.height, self.width, self.channels)
+        return np.ctypeslib.as_array(pointer, shape=(self.layers,) + shape if self.layers > 1 else shape)
+
+    def unmap(self):
+        slot = (self.head - self.pending) % len(self.pbos)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.pbos[slot])
+        glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        self.pending -= 1
+
+    def deleteBuffers(self):
+        for fence in self.fences:
+            if fence is not None:
+                glDeleteSync(fence)
+        glDeleteBuffers(len(self.pbos), self.pbos)
+
 class Mesh:
     def __init__(self, meshPath):
-
-        # Parsing custom .mesh fileformat
-        self.vertices = []
-        self.normals = []
-        self.uvs = []
-        self.vertexIndices = []
-        self.normalIndices = []
-        self.uvIndices = []
-        self.vboData = []
-        self.indices = []
-        with open(meshPath, 'r') as meshFile:
-            for line in meshFile:
-                sLine = line.split()
-                if not len(sLine):
-                    continue
-                if sLine[0] == "v":
-                    #self.vertexData = self.vertexData + sLine[1:]
-                    self.vertices = self.vertices + sLine[1:]
-                if sLine[0] == "vt":
-                    self.uvs = self.uvs + sLine[1:]
-                if sLine[0] == "vn":
-                    self.normals = self.normals + sLine[1:]
-                if sLine[0] == "f":
-                    for element in sLine[1:]:
-                        indices = element.split('/')
-                        self.vertexIndices.append(indices[0])
-                        self.uvIndices.append(indices[1])
-                        self.normalIndices.append(indices[2])
-
-        self.vertices = np.array(self.vertices, dtype=np.float32)
-        self.normals = np.array(self.normals, dtype=np.float32)
-        self.uvs = np.array(self.uvs, dtype=np.float32)
-        self.vertexIndices = np.array(self.vertexIndices, dtype=np.uint32) - 1
-        self.normalIndices = np.array(self.normalIndices, dtype=np.uint32) - 1
-        self.uvIndices = np.array(self.uvIndices, dtype=np.uint32) - 1
-        tmp = -np.ones((int(len(self.vertices)/3), int(len(self.uvs)/2), int(len(self.normals)/3)))
-
-        for v, t, n in zip(self.vertexIndices, self.uvIndices, self.normalIndices):
-            if tmp[v, t, n] == -1:
-                tmp[v, t, n] = int(len(self.vboData) / 8)
-                self.vboData.append(self.vertices[v * 3])
-                self.vboData.append(self.vertices[v * 3 + 1])
-                self.vboData.append(self.vertices[v * 3 + 2])
-                self.vboData.append(self.uvs[t * 2])
-                self.vboData.append(self.uvs[t * 2 + 1])
-                self.vboData.append(self.normals[n * 3])
-                self.vboData.append(self.normals[n * 3 + 1])
-                self.vboData.append(self.normals[n * 3 + 2])
-            index = tmp[v, t, n]
-            self.indices.append(index)
-        self.vboData = np.array(self.vboData, dtype=np.float32)
-        self.indices = np.array(self.indices, dtype=np.uint32)
-
+        # interleaved position, uv and normal per vertex, cached next to the mesh and memory mapped on later loads
+        self.vboData, self.indices = self.loadCache(meshPath)
+        if self.vboData is None:
+            self.vboData, self.indices = self.parse(meshPath)
+            self.storeCache(meshPath)
 
         # OpenGL related calls
         self.vao = glGenVertexArrays(1)
@@ -254,27 +676,118 @@ class Mesh:
         glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ibo)
         glBufferData(GL_ELEMENT_ARRAY_BUFFER, self.indices, GL_STATIC_DRAW)
 
-        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, self.vboData[0].nbytes*8, None)
+        stride = self.vboData.itemsize * 8
+        glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, stride, None)
         glEnableVertexAttribArray(0)
-        glVertexAttribPointer(1, 2, GL_FLOAT, GL_FALSE, self.vboData[0].nbytes * 8, ctypes.c_void_p(self.vboData[0].nbytes * 3))
+        glVertexAttribPointer(1, 2, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(self.vboData.itemsize * 3))
         glEnableVertexAttribArray(1)
-        glVertexAttribPointer(2, 3, GL_FLOAT, GL_FALSE, self.vboData[0].nbytes*8, ctypes.c_void_p(self.vboData[0].nbytes*5))
+        glVertexAttribPointer(2, 3, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(self.vboData.itemsize * 5))
         glEnableVertexAttribArray(2)
 
         glBindBuffer(GL_ARRAY_BUFFER, 0)
         glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
         glBindVertexArray(0)
 
+    @staticmethod
+    def cachePaths(meshPath):
+        return meshPath + '.vbo.npy', meshPath + '.ibo.npy'
+
+    def loadCache(self, meshPath):
+        vboPath, iboPath = self.cachePaths(meshPath)
+        try:
+            meshTime = os.path.getmtime(meshPath)
+            if os.path.getmtime(vboPath) < meshTime or os.path.getmtime(iboPath) < meshTime:
+                return None, None
+            return np.load(vboPath, mmap_mode='r'), np.load(iboPath, mmap_mode='r')
+        except (OSError, ValueError):
+            return None, None
+
+    def storeCache(self, meshPath):
+        # a read-only mesh directory only costs the parse on every load
+        for path, data in zip(self.cachePaths(meshPath), (self.vboData, self.indices)):
+            temporary = '%s.%d.npy' % (path, os.getpid())
+            try:
+                np.save(temporary, data)
+                os.replace(temporary, path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def parse(meshPath):
+        # Parsing .obj files, lines are grouped by their keyword and converted in bulk
+        with open(meshPath, 'r') as meshFile:
+            lines = [line.split(None, 1) for line in meshFile]
+        groups = {'v': [], 'vt': [], 'vn': [], 'f': []}
+        for line in lines:
+            if len(line) == 2 and line[0] in groups:
+                groups[line[0]].append(line[1])
+
+        def attribute(rows, components):
+            if not rows:
+                return np.zeros((1, components), dtype=np.float32)
+            # optional trailing components like the w of vt or vertex colors are dropped; rows are only converted
+            # at once when all of them have the same number of values, mixed rows would shift into wrong vertices
+            lengths = set(len(row.split()) for row in rows)
+            if len(lengths) == 1:
+                length = lengths.pop()
+                values = np.fromstring(' '.join(rows), dtype=np.float32, sep=' ')
+                if length >= components and len(values) == len(rows) * length:
+                    return values.reshape(len(rows), length)[:, :components]
+            return np.array([row.split()[:components] for row in rows], dtype=np.float32)
+
+        vertices = attribute(groups['v'], 3)
+        uvs = attribute(groups['vt'], 2)
+        normals = attribute(groups['vn'], 3)
+
+        # v, v/t, v//n or v/t/n corners, faces with more than three corners are triangulated as fans
+        counts = np.array([len(face.split()) for face in groups['f']], dtype=np.int64)
+        corners = ' '.join(groups['f']).replace('//', '/0/').split()
+        slashes = {corner.count('/') for corner in corners}
+        if len(slashes) == 1:
+            # all corners have the same form, convert them at once and pad the missing uv and normal
+            fields = slashes.pop() + 1
+            values = np.fromstring(' '.join(corners).replace('/', ' '), dtype=np.int64, sep=' ').reshape(-1, fields)
+            corners = np.zeros((len(values), 3), dtype=np.int64)
+            corners[:, :fields] = values
+        else:
+            corners = np.array([[int(index) if index else 0 for index in (corner + '//').split('/')[:3]]
+                                for corner in corners], dtype=np.int64).reshape(-1, 3)
+        for column, count in enumerate((len(groups['v']), len(groups['vt']), len(groups['vn']))):
+            # 1-based, negative indices count from the end, missing ones use the first (or a zero) attribute
+            indices = corners[:, column]
+            corners[:, column] = np.where(indices < 0, indices + count, np.maximum(indices - 1, 0))
+
+        triangles = np.maximum(counts - 2, 0)
+        first = np.cumsum(counts) - counts
+        face = np.repeat(np.arange(len(counts)), triangles)
+        local = np.arange(triangles.sum()) - np.repeat(np.cumsum(triangles) - triangles, triangles)
+        corner = np.stack([first[face], first[face] + local + 1, first[face] + local + 2], axis=1).reshape(-1)
+
+        # every distinct (v, t, n) triple becomes one vertex, numbered in order of first use
+        corners = corners[corner]
+        keys = (corners[:, 0] * len(uvs) + corners[:, 1]) * len(normals) + corners[:, 2]
+        _, firstUse, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        order = np.argsort(firstUse)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        unique = corners[firstUse[order]]
+
+        vboData = np.concatenate([vertices[unique[:, 0]], uvs[unique[:, 1]], normals[unique[:, 2]]], axis=1)
+        return np.ascontiguousarray(vboData, dtype=np.float32), rank[inverse.reshape(-1)].astype(np.uint32)
+
     def printData(self):
         for v in self.vboData:
             print(v)
         print(self.indices)
 
-    def draw(self, shader, style=GL_TRIANGLES):
+    def draw(self, shader, style=GL_TRIANGLES, instances=1):
         glUseProgram(shader)
         glBindVertexArray(self.vao)
         glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ibo)
-        glDrawElements(style, len(self.indices), GL_UNSIGNED_INT, None)
+        if instances > 1:
+            glDrawElementsInstanced(style, len(self.indices), GL_UNSIGNED_INT, None, instances)
+        else:
+            glDrawElements(style, len(self.indices), GL_UNSIGNED_INT, None)
         glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
         glBindVertexArray(0)
         glUseProgram(0)
\ No newline at end of file
@@ -0,0 +1,125 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from Blur import blurRadius, gaussianKernel
+from TemporalGradient import temporalWeights
+
+# reference implementation of the shader pipeline on (T, H, W) batches of gray frames,
+# texture lookups outside of the frame are clamped to the edge like the render targets
+
+epsilon = 0.000000001
+pi = np.pi + epsilon
+
+# window of optical_flow.frag, 3x3 weights whose taps are 3 texels apart
+lucasKanadeKernel = np.array([[1, 2, 1], [2, 4, 2], [1, 2, 1]], dtype=np.float32)
+lucasKanadeDilation = 3
+
+# center and four direct neighbours, averaged by structure_tensor.frag
+crossKernel = np.array([[0, 1, 0], [1, 1, 1], [0, 1, 0]], dtype=np.float32) / 5
+
+
+def gray(frames):
+    # (T, H, W, 3) uint8 -> (T, H, W) float32 in [0, 1]
+    return frames.mean(axis=-1, dtype=np.float32) / 255
+
+
+def correlate(frames, kernel, axis, dilation=1):
+    radius = len(kernel) // 2 * dilation
+    padding = [(0, 0)] * frames.ndim
+    padding[axis] = (radius, radius)
+    windows = sliding_window_view(np.pad(frames, padding, mode='edge'), 2 * radius + 1, axis=axis)[..., ::dilation]
+    return np.einsum('...k,k->...', windows, np.asarray(kernel, dtype=np.float32))
+
+
+def correlate2d(frames, kernel, dilation=1):
+    ry, rx = kernel.shape[0] // 2 * dilation, kernel.shape[1] // 2 * dilation
+    padded = np.pad(frames, [(0, 0), (ry, ry), (rx, rx)], mode='edge')
+    windows = sliding_window_view(padded, (2 * ry + 1, 2 * rx + 1), axis=(1, 2))[..., ::dilation, ::dilation]
+    return np.einsum('...yx,yx->...', windows, kernel)
+
+
+def boxBlur(frames, size=3):
+    kernel = np.ones(size, dtype=np.float32) / size
+    return correlate(correlate(frames, kernel, 2), kernel, 1)
+
+
+def gaussianBlur(frames, sigma, radius=None):
+    if radius is None:
+        radius = blurRadius(sigma)
+    kernel = gaussianKernel(sigma, radius).astype(np.float32)
+    return correlate(correlate(frames, kernel, 2), kernel, 1)
+
+
+def spatialGradients(frames):
+    # gradient_s.frag, central differences along x and y
+    difference = np.array([-0.5, 0, 0.5], dtype=np.float32)
+    return correlate(frames, difference, 2), correlate(frames, difference, 1)
+
+
+def temporalGradient(frames, window=2):
+    # the generated gradient shader, one gradient for every frame that has window - 1 predecessors
+    count = len(frames) - window + 1
+    weights = temporalWeights(window).astype(np.float32)
+    return sum(weight * frames[window - 1 - age:window - 1 - age + count] for age, weight in enumerate(weights))
+
+
+def structureTensor(ix, iy, it):
+    # structure_tensor.frag, products of the smoothed gradients
+    ix = correlate2d(ix, crossKernel)
+    iy = correlate2d(iy, crossKernel)
+    it = correlate2d(it, crossKernel)
+    return ix * ix, ix * iy, iy * iy, ix * it, iy * it
+
+
+def lucasKanade(m11, m12, m22, q1, q2):
+    # optical_flow.frag, weighted window sums and the 2x2 solve, returns (T, H, W, [vx, vy, r, angle])
+    kernel = lucasKanadeKernel / lucasKanadeKernel.sum()
+    m11, m12, m22, q1, q2 = [correlate2d(m, kernel, lucasKanadeDilation) for m in (m11, m12, m22, q1, q2)]
+    determinant = m12 * m12 - m11 * m22 + epsilon
+    vx = (m22 * q1 - m12 * q2) / determinant
+    vy = (m11 * q2 - m12 * q1) / determinant
+    r = np.sqrt(vx * vx + vy * vy)
+    angle = np.arctan2(vy, vx) / 2 / pi
+    return np.stack([vx, vy, r, angle], axis=-1)
+
+
+def mipmapSmooth(data, lod=4):
+    # passthrough_of.frag, box filtered mipmap level lod sampled bilinearly at every texel center
+    level = data
+    for i in range(lod):
+        t, h, w, c = level.shape
+        h, w = max(1, h // 2), max(1, w // 2)
+        if level.shape[1] > 1:
+            level = level[:, :2 * h].reshape(t, h, 2, level.shape[2], c).mean(axis=2)
+        if level.shape[2] > 1:
+            level = level[:, :, :2 * w].reshape(t, h, w, 2, c).mean(axis=3)
+
+    def coordinates(size, levelSize):
+        position = np.clip((np.arange(size) + 0.5) * levelSize / size - 0.5, 0, levelSize - 1)
+        index = np.minimum(position.astype(np.int64), max(levelSize - 2, 0))
+        return index, np.minimum(index + 1, levelSize - 1), (position - index).astype(np.float32)
+
+    y0, y1, wy = coordinates(data.shape[1], level.shape[1])
+    x0, x1, wx = coordinates(data.shape[2], level.shape[2])
+    wy = wy[None, :, None, None]
+    wx = wx[None, None, :, None]
+    top = level[:, y0][:, :, x0] * (1 - wx) + level[:, y0][:, :, x1] * wx
+    bottom = level[:, y1][:, :, x0] * (1 - wx) + level[:, y1][:, :, x1] * wx
+    return top * (1 - wy) + bottom * wy
+
+
+def padFrames(frames, align=16):
+    # the pipeline runs on whole 16x16 blocks, the frames are padded with their last row and column
+    t, h, w = frames.shape
+    return np.pad(frames, [(0, 0), (0, -h % align), (0, -w % align)], mode='edge')
+
+
+def opticalFlow(frames, sigma=1.0, radius=None, window=2, smooth=True):
+    # (T, H, W, 3) uint8 frames in texture orientation -> (T - window + 1, H, W, [vx, vy, r, angle])
+    height, width = frames.shape[1:3]
+    image = gaussianBlur(padFrames(gray(frames)), sigma, radius)
+    it = temporalGradient(image, window)
+    ix, iy = spatialGradients(image[window - 1:])
+    data = lucasKanade(*structureTensor(ix, iy, it))
+    if smooth:
+        data = mipmapSmooth(data)
+    return data[:, :height, :width].astype(np.float32)
@@ -0,0 +1,75 @@
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from GLContext import *
+
+
+class Profiler():
+    # GPU time per pass from GL_TIME_ELAPSED queries that are read back a few frames later, so they never stall the pipeline
+    def __init__(self, latency=3, warmup=1):
+        self.latency = latency
+        self.warmup = warmup
+        self.freeQueries = []
+        self.frames = deque()
+        self.currentFrame = []
+        self.frameIndex = 0
+        self.resolvedFrames = 0
+        self.gpuTime = OrderedDict()
+        self.cpuTime = OrderedDict()
+        self.cpuFrames = 0
+
+    def begin(self, label):
+        query = self.freeQueries.pop() if self.freeQueries else glGenQueries(1)[0]
+        glBeginQuery(GL_TIME_ELAPSED, query)
+        self.currentFrame.append((label, query))
+
+    def end(self):
+        glEndQuery(GL_TIME_ELAPSED)
+
+    @contextmanager
+    def cpu(self, label):
+        start = time.perf_counter()
+        yield
+        if self.frameIndex >= self.warmup:
+            self.cpuTime[label] = self.cpuTime.get(label, 0.0) + time.perf_counter() - start
+
+    def endFrame(self):
+        self.frames.append((self.frameIndex, self.currentFrame))
+        self.currentFrame = []
+        if self.frameIndex >= self.warmup:
+            self.cpuFrames += 1
+        self.frameIndex += 1
+        while len(self.frames) > self.latency:
+            self.resolve(*self.frames.popleft())
+
+    def resolve(self, frameIndex, queries):
+        elapsed = ctypes.c_uint64()
+        for label, query in queries:
+            glGetQueryObjectui64v(query, GL_QUERY_RESULT, ctypes.byref(elapsed))
+            # the first frames include shader compilation and driver warm up
+            if frameIndex >= self.warmup:
+                self.gpuTime[label] = self.gpuTime.get(label, 0.0) + elapsed.value * 1e-9
+            self.freeQueries.append(query)
+        if frameIndex >= self.warmup:
+            self.resolvedFrames += 1
+
+    def finish(self):
+        while self.frames:
+            self.resolve(*self.frames.popleft())
+        glDeleteQueries(len(self.freeQueries), self.freeQueries)
+        self.freeQueries = []
+
+    def report(self):
+        # milliseconds per frame
+        return {
+            'gpu': OrderedDict((label, 1000 * t / max(self.resolvedFrames, 1)) for label, t in self.gpuTime.items()),
+            'cpu': OrderedDict((label, 1000 * t / max(self.cpuFrames, 1)) for label, t in self.cpuTime.items()),
+        }
+
+    def summary(self):
+        report = self.report()
+        lines = []
+        for kind in ['gpu', 'cpu']:
+            for label, ms in report[kind].items():
+                lines.append('%s %-20s %8.3f ms' % (kind, label, ms))
+        return '\n'.join(lines)
@@ -0,0 +1,110 @@
+from GLContext import *
+
+
+class PyramidalFlow():
+    # coarse to fine Lucas Kanade on a Gaussian pyramid, the pyramid of the previous frame is kept and reused
+    def __init__(self, context, canvas, width, height, levels=4, iterations=3, radius=2):
+        self.context = context
+        self.canvas = canvas
+        self.iterations = max(1, iterations)
+        self.radius = radius
+
+        # the coarsest level keeps at least a few texels in both directions
+        self.levels = 1
+        while self.levels < levels and min(width, height) >> self.levels >= 8:
+            self.levels += 1
+        self.sizes = [(max(1, width >> level), max(1, height >> level)) for level in range(self.levels)]
+
+        self.pyramids = [self.createPyramid(), self.createPyramid()]
+        self.current = 0
+        self.fb_flow = []
+        for width, height in self.sizes:
+            pair = [FrameBuffer(width=width, height=height, formats=[GL_RG32F]) for i in range(2)]
+            for fb in pair:
+                fb.color_buffer_textures[0].setWrap(GL_CLAMP_TO_EDGE)
+                # zero flow, so no target ever holds uninitialized memory
+                fb.clear_color = np.zeros(4, dtype=np.float32)
+                fb.init()
+            self.fb_flow.append(pair)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+        # shaders
+        self.shader_gray = context.createShader('shaders/passthrough.vert', 'shaders/gray.frag')
+        glUseProgram(self.shader_gray)
+        glUniform1i(glGetUniformLocation(self.shader_gray, 'scene'), 0)
+        glUseProgram(0)
+
+        self.shader_pyramid_down = context.createShader('shaders/passthrough.vert', 'shaders/pyramid_down.frag')
+        glUseProgram(self.shader_pyramid_down)
+        glUniform1i(glGetUniformLocation(self.shader_pyramid_down, 'scene'), 0)
+        glUseProgram(0)
+
+        self.shader_lk = context.createShader('shaders/passthrough.vert', 'shaders/lk_pyramid.frag')
+        glUseProgram(self.shader_lk)
+        glUniform1i(glGetUniformLocation(self.shader_lk, 'image'), 0)
+        glUniform1i(glGetUniformLocation(self.shader_lk, 'image_previous'), 1)
+        glUniform1i(glGetUniformLocation(self.shader_lk, 'flow_in'), 2)
+        glUniform1i(glGetUniformLocation(self.shader_lk, 'radius'), self.radius)
+        glUseProgram(0)
+
+        self.shader_flow_visualize = context.createShader('shaders/passthrough.vert', 'shaders/flow_visualize.frag')
+        glUseProgram(self.shader_flow_visualize)
+        glUniform1i(glGetUniformLocation(self.shader_flow_visualize, 'flow_in'), 0)
+        glUseProgram(0)
+
+        # uniforms updated for every level
+        self.location_down_width = context.uniformLocation(self.shader_pyramid_down, 'width')
+        self.location_down_height = context.uniformLocation(self.shader_pyramid_down, 'height')
+        self.location_lk_width = context.uniformLocation(self.shader_lk, 'width')
+        self.location_lk_height = context.uniformLocation(self.shader_lk, 'height')
+        self.location_lk_flow_scale = context.uniformLocation(self.shader_lk, 'flow_scale')
+
+    def createPyramid(self):
+        pyramid = []
+        for width, height in self.sizes:
+            fb = FrameBuffer(width=width, height=height, formats=[GL_R32F])
+            fb.color_buffer_textures[0].setWrap(GL_CLAMP_TO_EDGE)
+            pyramid.append(fb)
+        return pyramid
+
+    def buildPyramid(self, scene, pyramid):
+        pyramid[0].init([scene])
+        self.canvas.draw(self.shader_gray)
+        for level in range(1, self.levels):
+            glUseProgram(self.shader_pyramid_down)
+            glUniform1i(self.location_down_width, self.sizes[level - 1][0])
+            glUniform1i(self.location_down_height, self.sizes[level - 1][1])
+            pyramid[level].init([pyramid[level - 1].getTexture(0)])
+            self.canvas.draw(self.shader_pyramid_down)
+
+    def render(self, scene, fb_output):
+        self.current = 1 - self.current
+        pyramid = self.pyramids[self.current]
+        pyramid_previous = self.pyramids[1 - self.current]
+        # all passes are full screen draws
+        self.context.transforms.bind(self.context.transforms.identity)
+        self.buildPyramid(scene, pyramid)
+
+        flow = None
+        for level in reversed(range(self.levels)):
+            glUseProgram(self.shader_lk)
+            glUniform1i(self.location_lk_width, self.sizes[level][0])
+            glUniform1i(self.location_lk_height, self.sizes[level][1])
+            for iteration in range(self.iterations):
+                glUseProgram(self.shader_lk)
+                if flow is None:
+                    flow_scale = 0.0
+                    flow = self.fb_flow[level][1].getTexture(0)
+                elif iteration == 0:
+                    flow_scale = 2.0
+                else:
+                    flow_scale = 1.0
+                glUniform1f(self.location_lk_flow_scale, flow_scale)
+
+                fb = self.fb_flow[level][iteration % 2]
+                fb.init([pyramid[level].getTexture(0), pyramid_previous[level].getTexture(0), flow])
+                self.canvas.draw(self.shader_lk)
+                flow = fb.getTexture(0)
+
+        fb_output.init([flow])
+        self.canvas.draw(self.shader_flow_visualize)
@@ -0,0 +1,174 @@
+from GLContext import *
+
+
+class RenderPass():
+    def __init__(self, name, shader=None, inputs=[], formats=None, output=None, uniforms=None, mipmaps=False,
+                 clear=True, translation=vec3(0, 0, 0), scale=1, callback=None, size=None, depth=False, label=None,
+                 condition=None):
+        self.name = name
+        # passes sharing a label are timed together by the profiler
+        self.label = label if label is not None else name
+        self.shader = shader
+        # 'resource' or 'resource:attachment', bound to texture units in this order
+        self.inputs = [(i.split(':')[0], int(i.split(':')[1]) if ':' in i else 0) for i in inputs]
+        # either an imported framebuffer or a transient target with one attachment per format
+        self.output = output if output is not None else name
+        self.formats = formats
+        self.uniforms = uniforms if uniforms is not None else {}
+        self.mipmaps = mipmaps
+        self.clear = clear
+        self.translation = translation
+        self.scale = scale
+        self.callback = callback
+        self.size = size
+        self.depth = depth
+        # callable deciding every frame whether the pass runs, its output keeps the last contents otherwise
+        self.condition = condition
+
+
+class RenderGraph():
+    # passes are declared once, compile() culls the ones nobody consumes and assigns pooled targets by lifetime
+    def __init__(self, context, canvas, width, height, layers=1):
+        self.context = context
+        self.canvas = canvas
+        self.width = width
+        self.height = height
+        # transient targets are texture arrays of this many layers, every draw is instanced once per layer
+        self.layers = layers
+        self.passes = []
+        self.importedTextures = {}
+        self.importedFramebuffers = {}
+        self.schedule = []
+        self.framebuffers = {}
+        # pooled attachment textures and the framebuffers built over them, by texture ids
+        self.pool = []
+        self.attachments = {}
+
+    def importTexture(self, name, texture):
+        # texture is a callable returning the texture id for the current frame
+        self.importedTextures[name] = texture
+
+    def importFramebuffer(self, name, framebuffer):
+        # framebuffer is a callable returning the FrameBuffer for the current frame
+        self.importedFramebuffers[name] = framebuffer
+
+    def addPass(self, name, **kwargs):
+        renderPass = RenderPass(name, **kwargs)
+        assert (renderPass.output in self.importedFramebuffers or renderPass.formats is not None)
+        self.passes.append(renderPass)
+        return renderPass
+
+    def compile(self, required):
+        # walk back from the required resources, a pass is live if a live pass or the caller consumes its output
+        needed = set(required)
+        live = set()
+        for index in reversed(range(len(self.passes))):
+            renderPass = self.passes[index]
+            if renderPass.output in needed:
+                live.add(index)
+                needed.update(name for name, attachment in renderPass.inputs)
+        self.schedule = [self.passes[index] for index in sorted(live)]
+
+        lastUse = {}
+        for index, renderPass in enumerate(self.schedule):
+            for name, attachment in renderPass.inputs:
+                lastUse[name] = index
+        for name in required:
+            lastUse[name] = len(self.schedule)
+
+        # a conditional pass whose output is read by a pass that may run without it must keep its contents
+        # between frames, its textures are never shared
+        consumers = {}
+        for renderPass in self.schedule:
+            for name, attachment in renderPass.inputs:
+                consumers.setdefault(name, []).append(renderPass.condition)
+        for name in required:
+            consumers.setdefault(name, []).append(None)
+        persistent = set(renderPass.output for renderPass in self.schedule if renderPass.condition is not None and
+                         any(condition is not renderPass.condition for condition in consumers.get(renderPass.output, [])))
+
+        # attachments are pooled by size and format, outputs whose lifetimes do not overlap share textures
+        # even when the passes writing them have different formats, every pass gets a framebuffer over its textures
+        self.framebuffers = {}
+        textures = {}
+        released = set()
+        free = []
+        for index, renderPass in enumerate(self.schedule):
+            for name in list(textures):
+                if name not in released and name not in persistent and lastUse.get(name, -1) < index:
+                    released.add(name)
+                    free.extend(textures[name])
+            if renderPass.output in self.importedFramebuffers or renderPass.output in textures:
+                continue
+            size = renderPass.size if renderPass.size is not None else (self.width, self.height)
+            attachments = []
+            for format in renderPass.formats:
+                texture = None
+                if renderPass.output not in persistent:
+                    texture = next((t for t in free if (t.width, t.height, t.internalFormat) == size + (format,)), None)
+                if texture is not None:
+                    free.remove(texture)
+                else:
+                    texture = Texture(size[0], size[1], internalFormat=format, layers=self.layers)
+                    texture.setWrap(GL_CLAMP_TO_EDGE)
+                    self.pool.append(texture)
+                attachments.append(texture)
+            textures[renderPass.output] = attachments
+            key = (tuple(texture.texture for texture in attachments), renderPass.depth)
+            if key not in self.attachments:
+                self.attachments[key] = FrameBuffer(width=size[0], height=size[1], textures=attachments,
+                                                    depth=renderPass.depth, layers=self.layers)
+            self.framebuffers[renderPass.output] = self.attachments[key]
+
+        # transforms and uniform locations do not change between frames, resolve them once
+        for renderPass in self.schedule:
+            if renderPass.shader is not None:
+                self.prepare(renderPass)
+
+    def framebuffer(self, name):
+        if name in self.importedFramebuffers:
+            return self.importedFramebuffers[name]()
+        return self.framebuffers[name]
+
+    def texture(self, name, attachment):
+        if name in self.importedTextures:
+            return self.importedTextures[name]()
+        return self.framebuffer(name).getTexture(attachment)
+
+    def prepare(self, renderPass):
+        modelMatrix = translationMatrix(renderPass.translation) @ scaleMatrix(renderPass.scale)
+        renderPass.transform = self.context.transforms.add(modelMatrix)
+        renderPass.uniformValues = []
+        for uniform, value in renderPass.uniforms.items():
+            location = self.context.uniformLocation(renderPass.shader, uniform)
+            if isinstance(value, tuple):
+                renderPass.uniformValues.append((glUniform2f, location, value))
+            elif isinstance(value, float):
+                renderPass.uniformValues.append((glUniform1f, location, (value,)))
+            else:
+                renderPass.uniformValues.append((glUniform1i, location, (value,)))
+
+    def setTransform(self, renderPass):
+        self.context.transforms.bind(renderPass.transform)
+        if renderPass.uniformValues:
+            glUseProgram(renderPass.shader)
+            for setUniform, location, value in renderPass.uniformValues:
+                setUniform(location, *value)
+            glUseProgram(0)
+
+    def execute(self, profiler=None):
+        for renderPass in self.schedule:
+            if renderPass.condition is not None and not renderPass.condition():
+                continue
+            if profiler is not None:
+                profiler.begin(renderPass.label)
+            textures = [self.texture(name, attachment) for name, attachment in renderPass.inputs]
+            framebuffer = self.framebuffer(renderPass.output)
+            if renderPass.callback is not None:
+                renderPass.callback(textures, framebuffer)
+            else:
+                self.setTransform(renderPass)
+                framebuffer.init(textures, clear=renderPass.clear, mipmaps=renderPass.mipmaps)
+                self.canvas.draw(renderPass.shader, instances=self.layers)
+            if profiler is not None:
+                profiler.end()
@@ -0,0 +1,194 @@
+from GLContext import *
+
+
+class SparseFlow():
+    # Shi-Tomasi corners picked from the structure tensor, Lucas Kanade is only solved at the tracked points
+    def __init__(self, context, canvas, width, height, points=1000, iterations=5, radius=3, redetect=10, blockSize=8,
+                 quality=0.01):
+        self.context = context
+        self.canvas = canvas
+        self.width = width
+        self.height = height
+        self.points = points
+        self.redetect = max(1, redetect)
+        self.blockSize = blockSize
+        self.quality = quality
+        # corners closer to the border than the window and its gradients are not tracked
+        self.margin = min(radius, 7) + 2
+
+        # one detector texel per block, so two corners are never closer than a block
+        self.gridSize = (-(-width // blockSize), -(-height // blockSize))
+        self.positions = np.full((points, 2), np.nan, dtype=np.float32)
+        self.flow = np.full((points, 2), np.nan, dtype=np.float32)
+        self.ids = np.full(points, -1, dtype=np.int64)
+        self.nextId = 0
+        self.frame = 0
+        self.detectNext = True
+
+        # shaders
+        self.shader_corners = context.createShader('shaders/passthrough.vert', 'shaders/corners.frag')
+        glUseProgram(self.shader_corners)
+        glUniform1i(glGetUniformLocation(self.shader_corners, 'tensor'), 0)
+        glUniform1i(glGetUniformLocation(self.shader_corners, 'block_size'), blockSize)
+        glUniform1i(glGetUniformLocation(self.shader_corners, 'margin'), self.margin)
+        glUniform1i(glGetUniformLocation(self.shader_corners, 'width'), width)
+        glUniform1i(glGetUniformLocation(self.shader_corners, 'height'), height)
+        glUseProgram(0)
+
+        self.shader_lk = context.createShader('shaders/passthrough.vert', 'shaders/sparse_lk.frag')
+        glUseProgram(self.shader_lk)
+        glUniform1i(glGetUniformLocation(self.shader_lk, 'image'), 0)
+        glUniform1i(glGetUniformLocation(self.shader_lk, 'image_previous'), 1)
+        glUniform1i(glGetUniformLocation(self.shader_lk, 'points'), 2)
+        glUniform1i(glGetUniformLocation(self.shader_lk, 'width'), width)
+        glUniform1i(glGetUniformLocation(self.shader_lk, 'height'), height)
+        glUniform1i(glGetUniformLocation(self.shader_lk, 'radius'), min(radius, 7))
+        glUniform1i(glGetUniformLocation(self.shader_lk, 'iterations'), max(1, iterations))
+        glUseProgram(0)
+
+        self.shader_tracks = context.createShader('shaders/tracks.vert', 'shaders/tracks.frag')
+        glUseProgram(self.shader_tracks)
+        glUniform1i(glGetUniformLocation(self.shader_tracks, 'width'), width)
+        glUniform1i(glGetUniformLocation(self.shader_tracks, 'height'), height)
+        glUseProgram(0)
+
+        self.shader_passthrough = context.createShader('shaders/passthrough.vert', 'shaders/passthrough.frag')
+        glUseProgram(self.shader_passthrough)
+        glUniform1i(glGetUniformLocation(self.shader_passthrough, 'scene'), 0)
+        glUseProgram(0)
+
+        # point i is stored in and solved at texel i of a small square target, a fragment is shaded per point
+        self.columns = int(math.ceil(math.sqrt(points)))
+        self.rows = -(-points // self.columns)
+        self.pointTexture = self.createPointTexture()
+        self.pointData = np.zeros((self.rows, self.columns, 2), dtype=np.float32)
+        self.fb_lk = FrameBuffer(width=self.columns, height=self.rows, formats=[GL_RGBA32F])
+        # the solved points and the corners go through pixel pack buffers, both copies are queued before either is waited on
+        self.readback_lk = PixelReadback(self.columns, self.rows, depth=2)
+        self.readback_corners = PixelReadback(*self.gridSize, depth=2)
+        self.vao_tracks, self.vbo_tracks = self.createPointBuffer(4)
+
+    def createPointTexture(self):
+        # storage is allocated once, the positions of every frame only replace the rows holding active points
+        texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, texture)
+        if bool(glTexStorage2D):
+            glTexStorage2D(GL_TEXTURE_2D, 1, GL_RG32F, self.columns, self.rows)
+        else:
+            glTexImage2D(GL_TEXTURE_2D, 0, GL_RG32F, self.columns, self.rows, 0, GL_RG, GL_FLOAT, None)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, 0)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        trackTextureMemory(self.columns * self.rows * textureBytes[GL_RG32F])
+        return texture
+
+    def createPointBuffer(self, components):
+        # positions drawn as GL_POINTS by the visualization
+        vao = glGenVertexArrays(1)
+        vbo = glGenBuffers(1)
+        glBindVertexArray(vao)
+        glBindBuffer(GL_ARRAY_BUFFER, vbo)
+        glBufferData(GL_ARRAY_BUFFER, self.points * components * 4, None, GL_STREAM_DRAW)
+        glVertexAttribPointer(0, components, GL_FLOAT, GL_FALSE, components * 4, None)
+        glEnableVertexAttribArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glBindVertexArray(0)
+        return vao, vbo
+
+    def drawPoints(self, shader, vao, vbo, data):
+        glBindBuffer(GL_ARRAY_BUFFER, vbo)
+        glBufferSubData(GL_ARRAY_BUFFER, 0, data.nbytes, data)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glUseProgram(shader)
+        glBindVertexArray(vao)
+        glDrawArrays(GL_POINTS, 0, len(data))
+        glBindVertexArray(0)
+        glUseProgram(0)
+
+    def detecting(self):
+        return self.detectNext
+
+    def render(self, scene, scene_previous, corners, fb_output):
+        self.flow[:] = np.nan
+        tracking = self.ids.max() >= 0
+        if tracking:
+            self.track(scene, scene_previous)
+        if self.detectNext:
+            self.readback_corners.pushTexture(corners)
+        if tracking:
+            self.updatePoints()
+        if self.detectNext:
+            self.detect()
+        self.frame += 1
+        self.detectNext = self.frame % self.redetect == 0 or np.count_nonzero(self.ids >= 0) < self.points // 2
+
+        # tracked points on top of the blurred frame
+        fb_output.init([scene])
+        self.canvas.draw(self.shader_passthrough)
+        active = self.ids >= 0
+        if active.any():
+            tracks = np.concatenate([self.positions[active], np.nan_to_num(self.flow[active])], axis=1)
+            glPointSize(5)
+            self.drawPoints(self.shader_tracks, self.vao_tracks, self.vbo_tracks, np.ascontiguousarray(tracks))
+
+    def track(self, scene, scene_previous):
+        # only the rows holding active points are uploaded and shaded, K texels instead of the whole frame
+        active = np.flatnonzero(self.ids >= 0)
+        rows = -(-len(active) // self.columns)
+        self.pointData.reshape(-1, 2)[:len(active)] = self.positions[active]
+        glBindTexture(GL_TEXTURE_2D, self.pointTexture)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        glTexSubImage2D(GL_TEXTURE_2D, 0, 0, 0, self.columns, rows, GL_RG, GL_FLOAT, self.pointData[:rows])
+        glBindTexture(GL_TEXTURE_2D, 0)
+        self.context.transforms.bind(self.context.transforms.identity)
+        self.fb_lk.init([scene, scene_previous, self.pointTexture])
+        glViewport(0, 0, self.columns, rows)
+        self.canvas.draw(self.shader_lk)
+        self.readback_lk.push(self.fb_lk, 0)
+
+    def updatePoints(self):
+        active = np.flatnonzero(self.ids >= 0)
+        result = self.readback_lk.map().reshape(-1, 4)[:len(active)].copy()
+        self.readback_lk.unmap()
+
+        positions = self.positions[active] + result[:, :2]
+        inside = np.all((positions >= self.margin) & (positions < np.array([self.width, self.height]) - self.margin), axis=1)
+        found = (result[:, 3] > 0) & inside
+        self.positions[active] = np.where(found[:, None], positions, np.nan)
+        self.flow[active] = np.where(found[:, None], result[:, :2], np.nan)
+        self.ids[active[~found]] = -1
+
+    def detect(self):
+        grid = self.readback_corners.map().copy()
+        self.readback_corners.unmap()
+
+        # blocks that already hold a tracked point are skipped
+        response = grid[..., 2].copy()
+        active = self.ids >= 0
+        blocks = (self.positions[active] // self.blockSize).astype(np.int64)
+        response[np.clip(blocks[:, 1], 0, self.gridSize[1] - 1), np.clip(blocks[:, 0], 0, self.gridSize[0] - 1)] = 0
+        response = response.reshape(-1)
+
+        free = np.flatnonzero(~active)
+        candidates = np.flatnonzero(response > max(self.quality * grid[..., 2].max(), 0))
+        count = min(len(free), len(candidates))
+        if count == 0:
+            return
+        strongest = candidates[np.argpartition(-response[candidates], count - 1)[:count]]
+        slots = free[:count]
+        self.positions[slots] = grid.reshape(-1, 4)[strongest, :2]
+        self.ids[slots] = np.arange(self.nextId, self.nextId + count)
+        self.nextId += count
+
+    def tracks(self):
+        # (points, [x, y, vx, vy, id]) in image coordinates, origin top left and y pointing down,
+        # the flow is the displacement from the previous frame and NaN for points detected in this frame
+        tracks = np.full((self.points, 5), np.nan, dtype=np.float32)
+        active = self.ids >= 0
+        tracks[active, 0] = self.positions[active, 0]
+        tracks[active, 1] = self.height - self.positions[active, 1]
+        tracks[active, 2] = self.flow[active, 0]
+        tracks[active, 3] = -self.flow[active, 1]
+        tracks[active, 4] = self.ids[active]
+        return tracks
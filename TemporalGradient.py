@@ -0,0 +1,43 @@
+import numpy as np
+
+gradientTemplate = """#version 330 core
+
+// generated by TemporalGradient.gradientShaderSource, window {window}
+{samplers}
+
+in vec2 uv;
+out vec4 color_0;
+
+float rgb2gray(vec3 v) {{
+    return (v.x + v.y + v.z) / 3;
+}}
+
+void main() {{
+    float lod = 0;
+    // backward difference of order window - 1 at the current frame, scene_i is the frame i steps back
+    vec3 gradient = vec3(0.0);
+{taps}
+    float gradient_t = rgb2gray(gradient);
+
+    // signed value, stored in a R16F target
+    color_0 = vec4(gradient_t, 0.0, 0.0, 1.0);
+}}
+"""
+
+
+def temporalWeights(window):
+    # weights of the frames 0, 1, ... window - 1 steps back whose sum is the first derivative at the current frame,
+    # exact for polynomials up to degree window - 1: [1, -1] for two frames, [1.5, -2, 0.5] for three
+    ages = np.arange(window, dtype=np.float64)
+    powers = np.arange(window)[:, None]
+    moments = np.zeros(window)
+    moments[1] = -1.0
+    return np.linalg.solve((ages[None, :] ** powers), moments)
+
+
+def gradientShaderSource(window):
+    weights = temporalWeights(window)
+    samplers = '\n'.join('uniform sampler2D scene_%d;' % age for age in range(window))
+    taps = '\n'.join('    gradient += %.8f * textureLod(scene_%d, uv, lod).xyz;' % (weight, age)
+                     for age, weight in enumerate(weights))
+    return gradientTemplate.format(window=window, samplers=samplers, taps=taps)
@@ -0,0 +1,67 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+from contextlib import redirect_stdout
+
+# offscreen by default, so the benchmark also runs on CPU-only machines with Mesa llvmpipe
+os.environ.setdefault('PYOPENGL_PLATFORM', 'egl')
+
+import numpy as np
+import matplotlib.pyplot as plt
+from main import Program
+from GLContext import textureMemory
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--resolutions', default='320x240,640x480,1280x720', type=str, help='comma separated list of WIDTHxHEIGHT')
+parser.add_argument('--frames', default=10, type=int, help='number of frames per sequence')
+parser.add_argument('--velocity', default='2,1', type=str, help='translation of the texture in pixels per frame, x,y')
+parser.add_argument('--flow', default='dense', choices=['dense', 'pyramid', 'sparse'], help='flow method passed on to main.py')
+parser.add_argument('--streams', default=1, type=int, help='number of copies of the sequence processed as one batch, dense flow only')
+parser.add_argument('--output', default=None, type=str, help='write the JSON report to this file instead of stdout')
+
+
+def createSequence(path, width, height, frames, velocity, seed=0):
+    # low pass filtered noise is periodic, so rolling it translates the texture without seams
+    rng = np.random.default_rng(seed)
+    noise = rng.random((height, width, 3))
+    fy = np.fft.fftfreq(height)[:, None, None]
+    fx = np.fft.fftfreq(width)[None, :, None]
+    texture = np.real(np.fft.ifft2(np.fft.fft2(noise, axes=(0, 1)) * np.exp(-(fx * fx + fy * fy) * 2000), axes=(0, 1)))
+    texture = (texture - texture.min()) / (texture.max() - texture.min())
+
+    for i in range(frames):
+        shift = (int(round(velocity[1] * i)), int(round(velocity[0] * i)))
+        plt.imsave(os.path.join(path, 'frame_%06d.png' % i), np.roll(texture, shift, (0, 1)))
+
+
+def benchmark(width, height, args):
+    velocity = [float(v) for v in args.velocity.split(',')]
+    with tempfile.TemporaryDirectory() as images:
+        createSequence(images, width, height, args.frames, velocity)
+        textureMemory['current'] = textureMemory['peak'] = 0
+        # keep stdout clean for the JSON report
+        with redirect_stdout(sys.stderr):
+            program = Program(['main.py', '--images'] + [images] * args.streams + ['--headless', '--profile', '--flow', args.flow])
+            stats = program.run()
+    stats['flow'] = args.flow
+    stats['velocity'] = velocity
+    return stats
+
+
+if __name__ == '__main__':
+    args = parser.parse_args(sys.argv[1:])
+    # shaders and meshes are loaded relative to the repository, only when run as a script so importing has no side effects
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    runs = []
+    for resolution in args.resolutions.split(','):
+        width, height = [int(v) for v in resolution.split('x')]
+        runs.append(benchmark(width, height, args))
+
+    report = json.dumps({'runs': runs}, indent=2)
+    if args.output is not None:
+        with open(args.output, 'w') as reportFile:
+            reportFile.write(report + '\n')
+    else:
+        print(report)
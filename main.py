@@ -1,189 +1,475 @@
+import os
 import sys
+import time
+import multiprocessing
+from contextlib import redirect_stdout
 import argparse
-from os import listdir
-from os.path import isfile, join
-import matplotlib.pyplot as plt
+from os.path import join, splitext
+from collections import deque
 from GLContext import *
+from FlowWriter import createFlowWriter, TrackWriter
+from FrameSource import createFrameSource, FrameDecoder
+from PyramidalFlow import PyramidalFlow
+from SparseFlow import SparseFlow
+from Blur import blurShaderSource, blurRadius
+from TemporalGradient import gradientShaderSource
+from RenderGraph import RenderGraph
+from Profiler import Profiler
+from NumpyFlow import opticalFlow
 
 parser = argparse.ArgumentParser()
-parser.add_argument('--images', default='./images', type=str, help='path to image files')
+parser.add_argument('--images', '--input', dest='images', default=['./images'], nargs='+', type=str, help='directory of image files or a video file, several inputs of the same size are processed as one batch')
+parser.add_argument('--start', default=0, type=int, help='first frame of the input')
+parser.add_argument('--stop', default=None, type=int, help='frame of the input to stop before, the end by default')
+parser.add_argument('--stride', default=1, type=int, help='use every stride-th frame of the input')
+parser.add_argument('--backend', default='gl', choices=['gl', 'numpy'], help='run the pipeline with OpenGL shaders or the NumPy reference implementation')
+parser.add_argument('--batch', default=8, type=int, help='number of frames processed at once by the numpy backend')
+parser.add_argument('--queue-depth', default=4, type=int, help='number of frames decoded ahead of the renderer')
+parser.add_argument('--workers', default=2, type=int, help='number of frame decoding processes for image directories')
+parser.add_argument('--sigma', default=1.0, type=float, help='standard deviation of the Gaussian blur in pixels')
+parser.add_argument('--blur-radius', default=None, type=int, help='radius of the Gaussian blur kernel, 3 sigma by default')
+parser.add_argument('--temporal-window', default=2, type=int, choices=range(2, 9), metavar='{2..8}',
+                    help='number of blurred frames the temporal gradient is computed from, a backward difference of one order less')
+parser.add_argument('--flow', default='dense', choices=['dense', 'pyramid', 'sparse'], help='single scale dense Lucas Kanade, coarse to fine pyramidal Lucas Kanade or Lucas Kanade at tracked corners')
+parser.add_argument('--levels', default=4, type=int, help='number of pyramid levels')
+parser.add_argument('--iterations', default=3, type=int, help='Lucas Kanade iterations per pyramid level')
+parser.add_argument('--window-radius', default=2, type=int, help='radius of the Lucas Kanade window of the pyramidal and sparse flow')
+parser.add_argument('--points', default=1000, type=int, help='number of points tracked by the sparse flow')
+parser.add_argument('--redetect', default=10, type=int, help='frames between two corner detections of the sparse flow')
+parser.add_argument('--shards', default=1, type=int, help='split the sequence into this many chunks rendered by separate processes, each with its own offscreen context')
+parser.add_argument('--tile', default=0, type=int, help='process frames in overlapping tiles of this size, chosen automatically for frames larger than the maximum texture size')
+parser.add_argument('--shader-cache', default='.shader_cache', type=str, help='directory of cached program binaries, empty to always compile')
+parser.add_argument('--profile', action='store_true', help='time every pass on the GPU and decode/upload on the CPU')
+parser.add_argument('--headless', action='store_true', help='render offscreen over the whole sequence without waiting for input')
+parser.add_argument('--output', default=None, type=str, help='flow output, a .npy file or a directory of .flo files')
 
 class Data():
-    def __init__(self, images):
-        self.images = images
-        self.files = [f for f in listdir(self.images) if isfile(join(self.images, f))]
-        self.files.sort()
+    def __init__(self, path, queueDepth=4, workers=2, start=0, stop=None, stride=1):
+        self.source = createFrameSource(path)
+        self.width, self.height = self.source.width, self.source.height
+        # frames of the source that are handed out, a range with a stride
+        self.indices = range(start, self.source.frameCount if stop is None else min(stop, self.source.frameCount),
+                             max(1, stride))
+        self.frameCount = len(self.indices)
         self.currentIndex = 0
-        self.lastFrameReached = len(self.files) <= self.currentIndex
-
-        self.width, self.height = 0, 0
-        if not self.lastFrameReached:
-            image = self.openFile(join(self.images, self.files[self.currentIndex]))
-            self.height = image.shape[0]
-            self.width =image.shape[1]
-        else:
+        self.lastFrameReached = self.frameCount <= self.currentIndex
+        if self.lastFrameReached:
             sys.exit(0)
+        self.source.close()
+
+        # counters
+        self.starvedFrames = 0
+        self.decodeTime = 0.0
 
-    def openFile(self, file):
-        image = np.flip(plt.imread(file), 0).astype(np.float32) / 255.0
-        return image[..., :3]
+        # frames are decoded ahead of the renderer by separate processes into shared memory; still images are
+        # split round robin between the workers, a video is decoded by a single process from start to end
+        workers = 1 if self.source.sequential else max(1, min(workers, self.frameCount))
+        slots = -(-max(1, queueDepth) // workers) + 1
+        self.decoders = [FrameDecoder(path, self.indices[worker::workers], (self.height, self.width, 3), slots)
+                         for worker in range(workers)]
+        self.current = None
 
     def nextFrame(self):
-        if not self.lastFrameReached:
-            image = self.openFile(join(self.images, self.files[self.currentIndex]))
-            self.currentIndex += 1
-            self.lastFrameReached = len(self.files) <= self.currentIndex
-        return image
+        # the frame stays valid until the next call, None once the source ended, also before its announced frame count
+        if self.lastFrameReached:
+            return None
+        decoder = self.decoders[self.currentIndex % len(self.decoders)]
+        if not decoder.ready():
+            self.starvedFrames += 1
+        frame = decoder.get()
+        if self.current is not None:
+            self.current[0].release(self.current[1])
+            self.current = None
+        if frame is None:
+            self.frameCount = self.currentIndex
+            self.lastFrameReached = True
+            return None
+        slot, decodeTime = frame
+        self.current = (decoder, slot)
+        self.decodeTime += decodeTime
+        self.currentIndex += 1
+        self.lastFrameReached = self.frameCount <= self.currentIndex
+        return self.current[0].frames[self.current[1]]
+
+    def statistics(self):
+        return 'decode %.2fms/frame, renderer starved on %d of %d frames' % (
+            1000 * self.decodeTime / max(self.currentIndex, 1), self.starvedFrames, self.currentIndex)
+
+    def close(self):
+        for decoder in self.decoders:
+            decoder.close()
+
+class BatchData():
+    # inputs of the same size decoded side by side, frame i of every stream is handed out together
+    def __init__(self, paths, queueDepth=4, workers=2, start=0, stop=None, stride=1):
+        # the sizes are compared before any decoder process or shared memory is set up
+        sizes = []
+        for path in paths:
+            source = createFrameSource(path)
+            sizes.append((source.width, source.height))
+            source.close()
+        if len(set(sizes)) > 1:
+            raise ValueError('the inputs of a batch need the same frame size')
+        self.width, self.height = sizes[0]
+
+        workers = max(1, workers // len(paths))
+        self.streams = []
+        try:
+            for path in paths:
+                self.streams.append(Data(path, queueDepth, workers, start, stop, stride))
+        except BaseException:
+            # e.g. an input without frames, the decoders of the streams started so far are stopped
+            self.close()
+            raise
+        # streams are cut to the shortest one
+        self.frameCount = min(data.frameCount for data in self.streams)
+        self.currentIndex = 0
+        self.lastFrameReached = False
+
+    def nextFrame(self):
+        if self.lastFrameReached:
+            return None
+        frames = [data.nextFrame() for data in self.streams]
+        if any(frame is None for frame in frames):
+            self.frameCount = self.currentIndex
+            self.lastFrameReached = True
+            return None
+        self.currentIndex += 1
+        self.frameCount = min([self.frameCount] + [data.frameCount for data in self.streams])
+        self.lastFrameReached = self.frameCount <= self.currentIndex
+        return frames
+
+    def statistics(self):
+        decodeTime = sum(data.decodeTime for data in self.streams)
+        starvedFrames = sum(data.starvedFrames for data in self.streams)
+        return 'decode %.2fms/frame, renderer starved on %d of %d frames of %d streams' % (
+            1000 * decodeTime / max(self.currentIndex * len(self.streams), 1), starvedFrames, self.currentIndex,
+            len(self.streams))
+
+    def close(self):
+        for data in self.streams:
+            data.close()
 
 class Program():
     def __init__(self, argv):
         args = parser.parse_args(argv[1:])
-        self.data = Data(args.images)
+        self.headless = args.headless
+        self.output = args.output
+        self.profiler = Profiler() if args.profile else None
+        # several inputs are stacked into the layers of texture arrays, every pass draws all of them at once
+        self.layers = len(args.images)
+        # the options are checked before any decoder process is started
+        if self.layers > 1 and (not self.headless or args.flow != 'dense'):
+            parser.error('several inputs are only processed by headless runs of the dense flow')
+        halo = self.tileHalo(args.blur_radius if args.blur_radius is not None else blurRadius(args.sigma))
+        if args.tile > 0 and self.tilingError(args, halo) is not None:
+            parser.error(self.tilingError(args, halo))
+        if self.layers > 1:
+            self.data = BatchData(args.images, args.queue_depth, args.workers, args.start, args.stop, args.stride)
+        else:
+            self.data = Data(args.images[0], args.queue_depth, args.workers, args.start, args.stop, args.stride)
         print(self.data.width, self.data.height)
 
-        self.context = GLContext(int(self.data.width), int(self.data.height))
+        # the dense flow runs on frames padded to whole 16x16 blocks, so level 4 of the mipmaps that smooths the flow
+        # averages the same pixels in the whole frame and in every tile; the padding clamps to the edge of the frame
+        align = 16 if args.flow == 'dense' else 1
+        self.paddedWidth = -(-self.data.width // align) * align
+        self.paddedHeight = -(-self.data.height // align) * align
+
+        # headless runs only render into framebuffer objects, their context does not need the size of the frame
+        contextSize = (self.data.width, self.data.height)
+        if self.headless:
+            contextSize = (min(self.data.width, 1024), min(self.data.height, 1024))
+        self.context = GLContext(*contextSize, visible=not self.headless, shaderCache=args.shader_cache)
         self.canvas = Mesh(join('./meshes', 'quad_uv.obj'))
+        maxTextureSize = glGetIntegerv(GL_MAX_TEXTURE_SIZE)
+        if args.tile <= 0 and max(self.paddedWidth, self.paddedHeight) > maxTextureSize:
+            print('frames are larger than the maximum texture size %d, processing them in tiles' % maxTextureSize)
+            args.tile = min(maxTextureSize, 2048)
+            if self.tilingError(args, halo) is not None:
+                self.data.close()
+                parser.error(self.tilingError(args, halo))
+
+        # size of the pipeline, the whole padded frame or one tile, and of the uploaded frames
+        self.tiles = None
+        # only the blur passes run while the history is filled
+        self.blurOnly = False
+        self.width, self.height = self.paddedWidth, self.paddedHeight
+        self.frameWidth, self.frameHeight = self.data.width, self.data.height
+        if args.tile > 0:
+            tileSize = args.tile // 16 * 16
+            self.width, self.height = min(tileSize, self.paddedWidth), min(tileSize, self.paddedHeight)
+            self.frameWidth, self.frameHeight = self.width, self.height
+            self.tiles = self.createTiles(halo)
+            # the frame and its predecessors stay on the host, every tile blurs all of them again
+            self.frames = deque(maxlen=args.temporal_window)
+            self.pendingTiles = deque()
+            print('%d tiles of %dx%d' % (len(self.tiles), self.width, self.height))
 
         # framebuffer
-        self.fb_default = FrameBuffer(width=self.data.width, height=self.data.height, default=True)
-        self.fb_gaussian = FrameBuffer(width=self.data.width, height=self.data.height)
-        self.fb_gaussian_2 = FrameBuffer(width=self.data.width, height=self.data.height)
-        self.fb_scene = FrameBuffer(width=self.data.width, height=self.data.height)
-        self.fb_scene_previous = FrameBuffer(width=self.data.width, height=self.data.height)
-        self.fb_gradient_t = FrameBuffer(width=self.data.width, height=self.data.height)
-        self.fb_gradient_s = FrameBuffer(width=self.data.width, height=self.data.height, attachments=2)
-        self.fb_optical_flow = FrameBuffer(width=self.data.width, height=self.data.height, attachments=2)
-        self.fb_optical_flow_smooth = FrameBuffer(width=self.data.width, height=self.data.height, attachments=2)
+        self.fb_default = FrameBuffer(width=contextSize[0], height=contextSize[1], default=True)
+        # blurred frames, the current one and as many previous ones as the temporal gradient needs
+        self.temporal_window = args.temporal_window
+        self.history = FrameHistory(self.width, self.height, depth=self.temporal_window, formats=[GL_RGBA16F],
+                                    layers=self.layers)
 
         # shaders
-        self.shader_gaussian = self.context.createShader('shaders/gaussian.vert', 'shaders/gaussian.frag')
+        # separable blur, the kernel is baked into the generated fragment shader
+        with open('shaders/passthrough.vert', 'r') as vsFile:
+            vertexSource = vsFile.read()
+        gsString, defines = None, ()
+        if self.layers > 1:
+            with open('shaders/layered.geom', 'r') as gsFile:
+                gsString, defines = gsFile.read(), ['LAYERED']
+        self.shader_gaussian = self.context.createShaderFromSource(vertexSource, blurShaderSource(args.sigma, args.blur_radius),
+                                                                   gsString, defines)
         glUseProgram(self.shader_gaussian)
         glUniform1i(glGetUniformLocation(self.shader_gaussian, "scene"), 0)
-        glUniform1i(glGetUniformLocation(self.shader_gaussian, "width"), self.data.width)
-        glUniform1i(glGetUniformLocation(self.shader_gaussian, "height"), self.data.height)
         glUseProgram(0)
 
-        self.shader_passthrough = self.context.createShader('shaders/passthrough.vert', 'shaders/passthrough.frag')
+        self.shader_passthrough = self.createShader('shaders/passthrough.vert', 'shaders/passthrough.frag')
         glUseProgram(self.shader_passthrough)
         glUniform1i(glGetUniformLocation(self.shader_passthrough, 'scene'), 0)
         glUseProgram(0)
 
-        self.shader_gradient_t = self.context.createShader('shaders/passthrough.vert', 'shaders/gradient_t.frag')
+        # the finite difference weights of the temporal window are baked into the generated fragment shader
+        self.shader_gradient_t = self.context.createShaderFromSource(vertexSource, gradientShaderSource(self.temporal_window),
+                                                                     gsString, defines)
         glUseProgram(self.shader_gradient_t)
-        glUniform1i(glGetUniformLocation(self.shader_gradient_t, 'scene'), 0)
-        glUniform1i(glGetUniformLocation(self.shader_gradient_t, 'scene_previous'), 1)
+        for age in range(self.temporal_window):
+            glUniform1i(glGetUniformLocation(self.shader_gradient_t, 'scene_%d' % age), age)
         glUseProgram(0)
 
-        self.shader_gradient_s = self.context.createShader('shaders/passthrough.vert', 'shaders/gradient_s.frag')
+        self.shader_gradient_s = self.createShader('shaders/passthrough.vert', 'shaders/gradient_s.frag')
         glUseProgram(self.shader_gradient_s)
         glUniform1i(glGetUniformLocation(self.shader_gradient_s, 'scene'), 0)
-        glUniform1i(glGetUniformLocation(self.shader_gradient_s, 'width'), self.data.width)
-        glUniform1i(glGetUniformLocation(self.shader_gradient_s, 'height'), self.data.height)
+        glUniform1i(glGetUniformLocation(self.shader_gradient_s, 'width'), self.width)
+        glUniform1i(glGetUniformLocation(self.shader_gradient_s, 'height'), self.height)
+        glUseProgram(0)
+
+        self.shader_structure_tensor = self.createShader('shaders/passthrough.vert', 'shaders/structure_tensor.frag')
+        glUseProgram(self.shader_structure_tensor)
+        glUniform1i(glGetUniformLocation(self.shader_structure_tensor, "gradient_t"), 0)
+        glUniform1i(glGetUniformLocation(self.shader_structure_tensor, "gradient_s"), 1)
+        glUniform1i(glGetUniformLocation(self.shader_structure_tensor, "width"), self.width)
+        glUniform1i(glGetUniformLocation(self.shader_structure_tensor, "height"), self.height)
         glUseProgram(0)
 
-        self.shader_optical_flow = self.context.createShader('shaders/optical_flow.vert', 'shaders/optical_flow.frag')
+        # the layered optical flow computes its window in the fragment shader
+        opticalFlowVertex = 'shaders/passthrough.vert' if self.layers > 1 else 'shaders/optical_flow.vert'
+        self.shader_optical_flow = self.createShader(opticalFlowVertex, 'shaders/optical_flow.frag')
         glUseProgram(self.shader_optical_flow)
-        glUniform1i(glGetUniformLocation(self.shader_optical_flow, "gradient_t"), 0)
-        glUniform1i(glGetUniformLocation(self.shader_optical_flow, "gradient_s_x"), 1)
-        glUniform1i(glGetUniformLocation(self.shader_optical_flow, "gradient_s_y"), 2)
-        glUniform1i(glGetUniformLocation(self.shader_optical_flow, "width"), self.data.width)
-        glUniform1i(glGetUniformLocation(self.shader_optical_flow, "height"), self.data.height)
+        glUniform1i(glGetUniformLocation(self.shader_optical_flow, "tensor"), 0)
+        glUniform1i(glGetUniformLocation(self.shader_optical_flow, "mismatch"), 1)
+        glUniform1i(glGetUniformLocation(self.shader_optical_flow, "width"), self.width)
+        glUniform1i(glGetUniformLocation(self.shader_optical_flow, "height"), self.height)
         glUseProgram(0)
 
-        self.shader_passthrough_of = self.context.createShader('shaders/passthrough.vert', 'shaders/passthrough_of.frag')
+        self.shader_passthrough_of = self.createShader('shaders/passthrough.vert', 'shaders/passthrough_of.frag')
         glUseProgram(self.shader_passthrough_of)
         glUniform1i(glGetUniformLocation(self.shader_passthrough_of, "color_in"), 0)
         glUniform1i(glGetUniformLocation(self.shader_passthrough_of, "data_in"), 1)
         glUseProgram(0)
 
+        self.pyramid = None
+        if args.flow == 'pyramid':
+            self.pyramid = PyramidalFlow(self.context, self.canvas, self.data.width, self.data.height,
+                                         args.levels, args.iterations, args.window_radius)
+        self.sparse = None
+        if args.flow == 'sparse':
+            self.sparse = SparseFlow(self.context, self.canvas, self.data.width, self.data.height, args.points,
+                                     args.iterations, args.window_radius, args.redetect)
+
+        self.graph = self.createGraph()
         self.currentTexture = self.nextTexture()
+        if self.tiles is None:
+            # the first frame fills every slot of the history, so the first flow already has a predecessor
+            self.blurOnly = True
+            glDisable(GL_DEPTH_TEST)
+            for age in range(len(self.history)):
+                self.history.rotate()
+                self.graph.execute()
+            self.blurOnly = False
+
+    def tileHalo(self, radius):
+        # context a tile needs on every side: the blur, the central differences, the averaged gradients, the 3x3
+        # Lucas Kanade window three texels apart and the bilinear lookup in mipmap level 4 that smooths the flow
+        halo = radius + 1 + 1 + 3 + 2 * 16
+        # whole 16x16 blocks, tile origins stay aligned to the blocks of level 4
+        return -(-halo // 16) * 16
+
+    def tilingError(self, args, halo):
+        if not self.headless or args.flow != 'dense' or self.layers > 1:
+            return 'tiles are only processed by headless runs of the dense flow on a single input'
+        if args.output is not None and not args.output.endswith('.npy'):
+            return 'tiled runs write their flow to a .npy file'
+        if args.tile // 16 * 16 <= 2 * halo:
+            return 'tiles need to be larger than twice their halo of %d pixels' % halo
+        return None
+
+    def createTiles(self, halo):
+        # (x, y, width, height) written by a tile and the origin of the tile in the padded frame, in texture
+        # coordinates; only the inner part of a tile is written, the tiles at the border are moved inwards instead
+        # of padded further, so every origin is a multiple of 16 and the border clamps like the whole frame
+        ranges = []
+        for size, paddedSize, tileSize in [(self.data.width, self.paddedWidth, self.width),
+                                           (self.data.height, self.paddedHeight, self.height)]:
+            if tileSize >= paddedSize:
+                ranges.append([(0, size, 0)])
+                continue
+            step = tileSize - 2 * halo
+            ranges.append([(start, min(step, size - start), min(max(start - halo, 0), paddedSize - tileSize))
+                           for start in range(0, size, step)])
+        return [(x, y, width, height, regionX, regionY) for y, height, regionY in ranges[1]
+                for x, width, regionX in ranges[0]]
+
+    def createShader(self, vsFilename, fsFilename):
+        # batched runs draw one instance per stream, routed to its layer by the geometry shader
+        if self.layers > 1:
+            return self.context.createShader(vsFilename, fsFilename, 'shaders/layered.geom', ['LAYERED'])
+        return self.context.createShader(vsFilename, fsFilename)
+
+    def createGraph(self):
+        width, height = self.width, self.height
+        graph = RenderGraph(self.context, self.canvas, width, height, self.layers)
+        graph.importTexture('frame', lambda: self.currentTexture.texture)
+        for age in range(1, len(self.history)):
+            graph.importTexture('history%d' % age, lambda age=age: self.history.get(age).getTexture(0))
+        graph.importFramebuffer('gaussian', lambda: self.history.get(0))
+        graph.importFramebuffer('screen', lambda: self.fb_default)
+
+        # gaussian blur, horizontal and vertical pass
+        # the first pass also pads the frame, texels beyond its edge clamp to the last row and column
+        graph.addPass('blur_horizontal', shader=self.shader_gaussian, inputs=['frame'], formats=[GL_RGBA16F],
+                      uniforms={'direction': (1.0 / self.frameWidth, 0.0),
+                                'scale': (width / self.frameWidth, height / self.frameHeight)}, label='gaussian')
+        graph.addPass('blur_vertical', shader=self.shader_gaussian, inputs=['blur_horizontal'], output='gaussian',
+                      uniforms={'direction': (0.0, 1.0 / height), 'scale': (1.0, 1.0)}, label='gaussian')
+
+        # the first frame and the predecessors of the frame in every tile are only blurred into the history
+        flowing = lambda: not self.blurOnly
+
+        # signed gradients and flow are stored in float targets, half floats where the precision is sufficient
+        if self.pyramid is not None:
+            # runs while the history is filled too, the pyramid of the previous frame is kept by the pass itself
+            graph.addPass('optical_flow', inputs=['gaussian'], formats=[GL_RGBA8, GL_RGBA16F],
+                          callback=lambda textures, framebuffer: self.pyramid.render(textures[0], framebuffer))
+            previews = []
+        elif self.sparse is not None:
+            # the structure tensor and the corners are only computed on frames that detect new points
+            detecting = lambda: flowing() and self.sparse.detecting()
+            graph.addPass('gradient_t', shader=self.shader_gradient_t, formats=[GL_R16F], condition=detecting,
+                          inputs=['gaussian'] + ['history%d' % age for age in range(1, len(self.history))])
+            graph.addPass('gradient_s', shader=self.shader_gradient_s, inputs=['gaussian'], formats=[GL_RG16F],
+                          condition=detecting)
+            graph.addPass('structure_tensor', shader=self.shader_structure_tensor, inputs=['gradient_t', 'gradient_s'],
+                          formats=[GL_RGBA32F, GL_RGBA32F], condition=detecting)
+            graph.addPass('corners', shader=self.sparse.shader_corners, inputs=['structure_tensor:0'],
+                          formats=[GL_RGBA32F], size=self.sparse.gridSize, condition=detecting)
+            graph.addPass('sparse_flow', inputs=['gaussian', 'history1', 'corners'], formats=[GL_RGBA8], condition=flowing,
+                          callback=lambda textures, framebuffer: self.sparse.render(*textures, framebuffer))
+            previews = ['gradient_s', 'structure_tensor']
+        else:
+            graph.addPass('gradient_t', shader=self.shader_gradient_t, formats=[GL_R16F], condition=flowing,
+                          inputs=['gaussian'] + ['history%d' % age for age in range(1, len(self.history))])
+            graph.addPass('gradient_s', shader=self.shader_gradient_s, inputs=['gaussian'], formats=[GL_RG16F],
+                          condition=flowing)
+            # gradient products, computed once per pixel
+            graph.addPass('structure_tensor', shader=self.shader_structure_tensor, inputs=['gradient_t', 'gradient_s'],
+                          formats=[GL_RGBA32F, GL_RGBA32F], condition=flowing)
+            graph.addPass('optical_flow', shader=self.shader_optical_flow, inputs=['structure_tensor:0', 'structure_tensor:1'],
+                          formats=[GL_RGBA8, GL_RGBA16F], condition=flowing)
+            previews = ['gradient_s', 'gradient_t', 'structure_tensor']
+        # the flow that is read back and written
+        if self.sparse is not None:
+            self.result = 'sparse_flow'
+            previews += ['sparse_flow']
+        elif self.pyramid is not None:
+            # the coarse to fine estimate is already at full resolution, smoothing it at mipmap level 4 would discard that
+            self.result = 'optical_flow'
+            previews += ['optical_flow:0', 'optical_flow:1']
+        else:
+            self.result = 'optical_flow_smooth'
+            graph.addPass('optical_flow_smooth', shader=self.shader_passthrough_of, inputs=['optical_flow:0', 'optical_flow:1'],
+                          formats=[GL_RGBA8, GL_RGBA16F], mipmaps=True, label='smoothing', condition=flowing)
+            previews += ['optical_flow_smooth:0', 'optical_flow_smooth:1']
+
+        # final display, culled in headless runs
+        graph.addPass('display', shader=self.shader_passthrough, inputs=['frame'], output='screen', label='display')
+        for i, preview in enumerate(previews):
+            graph.addPass('preview%d' % i, shader=self.shader_passthrough, inputs=[preview], output='screen', clear=False,
+                          translation=vec3(0.8, 0.8 - 0.4 * i, 0.0), scale=0.19, label='display')
+
+        graph.compile([self.result] if self.headless else [self.result, 'screen'])
+        return graph
 
     def nextTexture(self):
+        # only sampled at lod 0, so no mipmaps are built for the uploaded frames
+        texture = StreamingTexture(self.frameWidth, self.frameHeight, layers=self.layers)
         image = self.data.nextFrame()
-        shape = image.shape
-        texture = Texture(height=shape[0], width=shape[1], data=image)
+        if image is None:
+            self.data.close()
+            sys.exit('no frame of the input could be read')
+        if self.tiles is not None:
+            # tiles are uploaded from the frames kept on the host
+            self.frames.append(image.copy())
+        else:
+            texture.setData(image)
         return texture
 
     def render(self):
-        if not self.data.lastFrameReached:
+        # False once the input ended, nothing is rendered then
+        if self.profiler is not None:
+            with self.profiler.cpu('decode'):
+                image = self.data.nextFrame()
+        else:
             image = self.data.nextFrame()
+        if image is None:
+            return False
+        if self.profiler is not None:
+            with self.profiler.cpu('upload'):
+                self.currentTexture.setData(image)
+        else:
             self.currentTexture.setData(image)
-            glDisable(GL_DEPTH_TEST)
-
-            # previous image
-            self.translateRender(self.shader_passthrough)
-            self.fb_scene_previous.init([self.fb_gaussian.getTexture(0)])
-            self.canvas.draw(self.shader_passthrough)
-
-            # current image
-            self.fb_scene.init([self.currentTexture.texture])
-            self.canvas.draw(self.shader_passthrough)
-
-            self.translateRender(self.shader_gaussian)
-            self.fb_gaussian.init([self.fb_scene.getTexture(0)])
-            self.canvas.draw(self.shader_gaussian)
-            for i in range(0):
-                # gaussian blur
-                self.fb_gaussian_2.init([self.fb_gaussian.getTexture(0)])
-                self.canvas.draw(self.shader_gaussian)
-                # current image
-                self.fb_gaussian.init([self.fb_gaussian_2.getTexture(0)])
-                self.canvas.draw(self.shader_gaussian)
-
-            # temporal gradient
-            self.translateRender(self.shader_gradient_t)
-            self.fb_gradient_t.init([self.fb_gaussian.getTexture(0), self.fb_scene_previous.getTexture(0)])
-            self.canvas.draw(self.shader_gradient_t)
-
-            # spatial gradients
-            self.translateRender(self.shader_gradient_s)
-            self.fb_gradient_s.init([self.fb_gaussian.getTexture(0)])
-            self.canvas.draw(self.shader_gradient_s)
-
-            # render optical flow
-            self.translateRender(self.shader_optical_flow)
-            self.fb_optical_flow.init([self.fb_gradient_t.getTexture(0), self.fb_gradient_s.getTexture(0), self.fb_gradient_s.getTexture(1)])
-            self.canvas.draw(self.shader_optical_flow)
-
-            self.translateRender(self.shader_passthrough_of)
-            self.fb_optical_flow_smooth.init([self.fb_optical_flow.getTexture(0), self.fb_optical_flow.getTexture(1)], mipmaps=True)
-            self.canvas.draw(self.shader_passthrough_of)
-
-            # final display
-            self.fb_default.init()
-            self.translateRender(self.shader_passthrough)
-            self.fb_default.bindTextures([self.currentTexture.texture])
-            self.canvas.draw(self.shader_passthrough)
-
-            self.translateRender(self.shader_passthrough, vec3(0.8, 0.8, 0.0), 0.19)
-            self.fb_default.bindTextures([self.fb_gradient_s.getTexture(0)])
-            self.canvas.draw(self.shader_passthrough)
-
-            self.translateRender(self.shader_passthrough, vec3(0.8, 0.4, 0.0), 0.19)
-            self.fb_default.bindTextures([self.fb_gradient_s.getTexture(1)])
-            self.canvas.draw(self.shader_passthrough)
-
-            self.translateRender(self.shader_passthrough, vec3(0.8, 0.0, 0.0), 0.19)
-            self.fb_default.bindTextures([self.fb_gradient_t.getTexture(0)])
-            self.canvas.draw(self.shader_passthrough)
-
-            self.translateRender(self.shader_passthrough, vec3(0.8, -0.4, 0.0), 0.19)
-            self.fb_default.bindTextures([self.fb_optical_flow_smooth.getTexture(0)])
-            self.canvas.draw(self.shader_passthrough)
-
-            self.translateRender(self.shader_passthrough, vec3(0.8, -0.8, 0.0), 0.19)
-            self.fb_default.bindTextures([self.fb_optical_flow_smooth.getTexture(1)])
-            self.canvas.draw(self.shader_passthrough)
-
-            self.translateRender(self.shader_passthrough)
+        glDisable(GL_DEPTH_TEST)
+
+        # the oldest blurred frame is overwritten by the current one
+        self.history.rotate()
+        self.graph.execute(self.profiler)
+        if self.profiler is not None:
+            self.profiler.endFrame()
+        return True
+
+    def renderTiles(self, writers, readback, index):
+        if self.profiler is not None:
+            with self.profiler.cpu('decode'):
+                image = self.data.nextFrame()
         else:
-            sys.exit(0)
-
-    def translateRender(self, shader, translation=vec3(0, 0, 0), scale=1):
-        glUseProgram(shader)
-        modelMatrix = translationMatrix(translation) @ scaleMatrix(scale)
-        glUniformMatrix4fv(glGetUniformLocation(shader, "modelMatrix"), 1, GL_TRUE, modelMatrix)
-        glUseProgram(0)
+            image = self.data.nextFrame()
+        if image is None:
+            return False
+        self.frames.append(image.copy())
+        # oldest first, the first frames of the sequence repeat the oldest one where predecessors are missing
+        frames = [self.frames[0]] * (self.frames.maxlen - len(self.frames)) + list(self.frames)
+        glDisable(GL_DEPTH_TEST)
+
+        for tile in self.tiles:
+            x, y, width, height, regionX, regionY = tile
+            for age, frame in enumerate(frames):
+                # the part of the tile beyond the frame repeats its last row and column
+                rows = np.take(frame, range(regionY, regionY + self.height), axis=0, mode='clip')
+                self.currentTexture.setData(np.take(rows, range(regionX, regionX + self.width), axis=1, mode='clip'))
+                self.history.rotate()
+                self.blurOnly = age < len(frames) - 1
+                self.graph.execute(self.profiler)
+            if writers:
+                readback.push(self.graph.framebuffer(self.result), 1)
+                self.pendingTiles.append((writers[0].first + index, tile))
+                if readback.full():
+                    self.writeFlow(writers, readback)
+        if self.profiler is not None:
+            self.profiler.endFrame()
+        return True
 
     def loop(self):
         self.render()
@@ -191,11 +477,270 @@ class Program():
         while not glfw.window_should_close(self.context.window):
             if glfw.get_key(self.context.window, glfw.KEY_RIGHT):
                 print('next Frame')
-                self.render()
+                if not self.render():
+                    break
                 glfw.swap_buffers(self.context.window)
-            glfw.poll_events()
+            # sleeps until the next input instead of spinning
+            glfw.wait_events()
+        if self.profiler is not None:
+            self.profiler.finish()
+            print(self.profiler.summary())
+        self.data.close()
         glfw.terminate()
 
+    def run(self, writers=None, skip=0, progress=None):
+        # shards pass writers opened at their place in the merged output and skip the flow of the frames they
+        # only load for the history; progress is called after every frame. The writers are sized from the announced
+        # frame count, an input that ends early leaves fewer frames
+        frames = self.data.frameCount - self.data.currentIndex - skip
+        if writers is None:
+            writers = []
+            if self.output is not None and self.sparse is not None:
+                # only the tracked points are written, not a dense field
+                writers = [TrackWriter(self.output, self.sparse.points, frames)]
+            elif self.output is not None:
+                writers = [createFlowWriter(path, self.data.width, self.data.height, frames) for path in self.outputPaths()]
+
+        readback = PixelReadback(self.width, self.height, layers=self.layers)
+
+        start = time.perf_counter()
+        rendered = 0
+        while not self.data.lastFrameReached:
+            output = writers if rendered >= skip else []
+            if self.tiles is not None:
+                # every tile is read back and written on its own
+                if not self.renderTiles(output, readback, rendered - skip):
+                    break
+            else:
+                if not self.render():
+                    break
+                if output and self.sparse is not None:
+                    output[0].write(self.sparse.tracks())
+                elif output:
+                    readback.push(self.graph.framebuffer(self.result), 1)
+                    if readback.full():
+                        self.writeFlow(output, readback)
+            rendered += 1
+            if progress is not None:
+                progress()
+        while not readback.empty():
+            self.writeFlow(writers, readback)
+        glFinish()
+        elapsed = time.perf_counter() - start
+        frames = max(rendered - skip, 0)
+
+        # fps counts the frames of all streams
+        stats = {'width': self.data.width, 'height': self.data.height, 'frames': frames, 'streams': self.layers,
+                 'tiles': len(self.tiles) if self.tiles is not None else 1,
+                 'seconds': elapsed, 'fps': frames * self.layers / max(elapsed, 1e-9),
+                 'peak_texture_memory_mb': textureMemory['peak'] / 2 ** 20, 'renderer': glGetString(GL_RENDERER).decode()}
+        if self.profiler is not None:
+            self.profiler.finish()
+            stats.update(self.profiler.report())
+
+        readback.deleteBuffers()
+        for writer in writers:
+            writer.close()
+        self.data.close()
+        self.context.terminate()
+        print('%d frames of %d streams in %.2fs (%.1f fps)' % (frames, self.layers, elapsed, stats['fps']))
+        print(self.data.statistics())
+        if self.profiler is not None:
+            print(self.profiler.summary())
+        return stats
+
+    def outputPaths(self):
+        # one output per stream of a batch, numbered after the output name
+        if self.layers == 1:
+            return [self.output]
+        base, extension = splitext(self.output.rstrip('/'))
+        return ['%s_%03d%s' % (base, stream, extension) for stream in range(self.layers)]
+
+    def writeFlow(self, writers, readback):
+        data = readback.map()
+        if self.tiles is not None:
+            # the inner part of the tile is stitched into the memory mapped result
+            index, (x, y, width, height, regionX, regionY) = self.pendingTiles.popleft()
+            writers[0].writeTile(index, x, y, data[y - regionY:y - regionY + height, x - regionX:x - regionX + width])
+        else:
+            # without the padding
+            for stream, writer in enumerate(writers):
+                writer.write((data[stream] if self.layers > 1 else data)[:self.data.height, :self.data.width])
+        readback.unmap()
+
+class NumpyProgram():
+    # dense flow of the NumPy reference implementation, batches of frames overlap by the temporal window
+    def __init__(self, argv):
+        args = parser.parse_args(argv[1:])
+        if args.flow != 'dense':
+            print('the numpy backend only implements the dense flow')
+        if len(args.images) > 1:
+            print('the numpy backend only processes the first input')
+        self.output = args.output
+        self.sigma = args.sigma
+        self.blur_radius = args.blur_radius
+        self.temporal_window = args.temporal_window
+        self.batch = max(1, args.batch)
+        self.data = Data(args.images[0], args.queue_depth, args.workers, args.start, args.stop, args.stride)
+        print(self.data.width, self.data.height)
+
+    def run(self):
+        window = self.temporal_window
+        # one flow per frame after the first, like the shaders
+        frames = max(self.data.frameCount - 1, 0)
+        writer = None
+        if self.output is not None:
+            writer = createFlowWriter(self.output, self.data.width, self.data.height, frames)
+
+        start = time.perf_counter()
+        batch = np.empty((self.batch + window - 1, self.data.height, self.data.width, 3), dtype=np.uint8)
+        count = 0
+        written = 0
+        while not self.data.lastFrameReached:
+            image = self.data.nextFrame()
+            if count == 0 and image is not None:
+                # the first frame also stands in for its missing predecessors, as in the primed history
+                batch[:window - 1] = image
+                count = window - 1
+            elif image is not None:
+                batch[count] = image
+                count += 1
+            if count == len(batch) or self.data.lastFrameReached:
+                if count >= window:
+                    flow = opticalFlow(batch[:count], self.sigma, self.blur_radius, window)
+                    written += len(flow)
+                    if writer is not None:
+                        for data in flow:
+                            writer.write(data)
+                # the last frames are the predecessors of the next batch
+                batch[:window - 1] = batch[count - window + 1:count]
+                count = window - 1
+        elapsed = time.perf_counter() - start
+        frames = written
+
+        if writer is not None:
+            writer.close()
+        self.data.close()
+        print('%d frames in %.2fs (%.1f fps)' % (frames, elapsed, frames / max(elapsed, 1e-9)))
+        print(self.data.statistics())
+        return {'width': self.data.width, 'height': self.data.height, 'frames': frames, 'seconds': elapsed,
+                'fps': frames / max(elapsed, 1e-9)}
+
+def renderShard(argv, shard, skip, index, frames, progress, results):
+    # runs in the shard process, the context is created here and never in the parent
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        program = Program(argv)
+        writers = []
+        if program.output is not None:
+            writers = [createFlowWriter(program.output, program.data.width, program.data.height, frames, index, create=False)]
+        stats = program.run(writers, skip, lambda: progress.put(shard))
+    results.put((shard, stats))
+
+class ShardedProgram():
+    # contiguous chunks of the sequence rendered by separate processes, every chunk starts with the frames the
+    # temporal gradient of its first flow needs, the flow is written in order into one output
+    def __init__(self, argv):
+        args = parser.parse_args(argv[1:])
+        if args.backend != 'gl' or args.flow == 'sparse' or len(args.images) > 1:
+            parser.error('shards run the dense or pyramidal flow of the OpenGL backend on a single input')
+        if os.environ.get('PYOPENGL_PLATFORM') != 'egl':
+            parser.error('shards render offscreen, set PYOPENGL_PLATFORM=egl')
+        self.argv = argv
+        self.output = args.output
+        self.window = args.temporal_window
+
+        source = createFrameSource(args.images[0])
+        self.width, self.height = source.width, source.height
+        stride = max(1, args.stride)
+        self.indices = range(args.start, source.frameCount if args.stop is None else min(args.stop, source.frameCount), stride)
+        source.close()
+        # the flow of frame i > 0 of the indices, split evenly between the shards
+        flows = len(self.indices) - 1
+        shards = max(1, min(args.shards, flows))
+        bounds = [1 + flows * shard // shards for shard in range(shards + 1)]
+        self.shards = []
+        for shard in range(shards):
+            first = max(bounds[shard] - (self.window - 1), 0)
+            self.shards.append({'first': first, 'stop': bounds[shard + 1], 'skip': bounds[shard] - first - 1,
+                                'index': bounds[shard] - 1, 'frames': bounds[shard + 1] - bounds[shard]})
+        self.frames = flows
+        print(self.width, self.height)
+
+    def shardArgv(self, shard):
+        # the chunk is selected with --start and --stop in frames of the source
+        start = self.indices[shard['first']]
+        stop = self.indices[shard['stop'] - 1] + 1
+        return self.argv + ['--start', str(start), '--stop', str(stop), '--shards', '1', '--headless']
+
+    def run(self):
+        writer = None
+        if self.output is not None:
+            # the merged output, the shards write their frames into it
+            writer = createFlowWriter(self.output, self.width, self.height, self.frames)
+        progress = multiprocessing.Queue()
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=renderShard, args=(self.shardArgv(shard), i, shard['skip'], shard['index'],
+                                                                         self.frames, progress, results))
+                     for i, shard in enumerate(self.shards)]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+
+        done = [0] * len(self.shards)
+        stats = {}
+        lastReport = start
+        while len(stats) < len(self.shards):
+            while not progress.empty():
+                done[progress.get()] += 1
+            while not results.empty():
+                shard, shardStats = results.get()
+                stats[shard] = shardStats
+            failed = [i for i, process in enumerate(processes) if process.exitcode not in (None, 0)]
+            if failed:
+                for process in processes:
+                    process.terminate()
+                raise RuntimeError('shard %d exited with code %d' % (failed[0], processes[failed[0]].exitcode))
+            if time.perf_counter() - lastReport > 1.0:
+                lastReport = time.perf_counter()
+                print('%d of %d frames' % (sum(done), sum(shard['skip'] + shard['frames'] for shard in self.shards)))
+            time.sleep(0.05)
+        for process in processes:
+            process.join()
+        while not progress.empty():
+            progress.get()
+        elapsed = time.perf_counter() - start
+
+        # an input that ends before its announced frame count only shortens the output in the last shard
+        short = [i for i, shard in enumerate(self.shards) if stats[i]['frames'] < shard['frames']]
+        if short and short[0] < len(self.shards) - 1:
+            raise RuntimeError('the input of shard %d ended after %d of %d frames' % (
+                short[0], stats[short[0]]['frames'], self.shards[short[0]]['frames']))
+        if short:
+            self.frames = self.shards[-1]['index'] + stats[short[0]]['frames']
+        if writer is not None:
+            writer.index = self.frames
+            writer.close()
+
+        for i, shard in enumerate(self.shards):
+            print('shard %d: flow of frames %d to %d, %d frames in %.2fs (%.1f fps)' % (
+                i, self.indices[shard['stop'] - shard['frames']], self.indices[shard['stop'] - 1], stats[i]['frames'],
+                stats[i]['seconds'], stats[i]['fps']))
+        print('%d frames in %.2fs (%.1f fps) with %d shards' % (self.frames, elapsed, self.frames / max(elapsed, 1e-9),
+                                                                len(self.shards)))
+        return {'width': self.width, 'height': self.height, 'frames': self.frames, 'seconds': elapsed,
+                'fps': self.frames / max(elapsed, 1e-9), 'shards': [stats[i] for i in range(len(self.shards))]}
+
 if __name__ == '__main__':
+    arguments = parser.parse_args(sys.argv[1:])
+    if arguments.backend == 'numpy':
+        NumpyProgram(sys.argv).run()
+        sys.exit(0)
+    if arguments.shards > 1:
+        ShardedProgram(sys.argv).run()
+        sys.exit(0)
+
     program = Program(sys.argv)
-    program.loop()
\ No newline at end of file
+    if program.headless:
+        program.run()
+    else:
+        program.loop()
\ No newline at end of file
@@ -0,0 +1,40 @@
+#version 330 core
+
+uniform sampler2D tensor;
+uniform int block_size;
+uniform int margin;
+uniform int width;
+uniform int height;
+
+out vec4 corner_out;
+
+void main() {
+    // one texel per block of the frame, keeps the strongest corner of the block
+    ivec2 origin = ivec2(gl_FragCoord.xy) * block_size;
+    vec3 best = vec3(0.0, 0.0, 0.0);
+
+    for (int y = 0; y < block_size; y++) {
+        for (int x = 0; x < block_size; x++) {
+            ivec2 p = origin + ivec2(x, y);
+            if (p.x < margin || p.y < margin || p.x >= width - margin || p.y >= height - margin) {
+                continue;
+            }
+
+            // gradient products summed over a 3x3 window
+            vec3 m = vec3(0);
+            for (int dy = -1; dy <= 1; dy++) {
+                for (int dx = -1; dx <= 1; dx++) {
+                    m += texelFetch(tensor, p + ivec2(dx, dy), 0).xyz;
+                }
+            }
+
+            // Shi-Tomasi response, the smaller eigenvalue of [[m11, m12], [m12, m22]]
+            float response = 0.5 * (m.x + m.z - sqrt((m.x - m.z) * (m.x - m.z) + 4.0 * m.y * m.y));
+            if (response > best.z) {
+                best = vec3(vec2(p) + 0.5, response);
+            }
+        }
+    }
+
+    corner_out = vec4(best, 0.0);
+}
@@ -0,0 +1,28 @@
+#version 330 core
+const float epsilon = 0.000000001;
+const float pi = 3.1415926535897932384626433832795 + epsilon;
+
+uniform sampler2D flow_in;
+
+in vec2 uv;
+out vec4 color_out, data_out;
+
+vec3 hsv2rgb(vec3 c)
+{
+    vec4 K = vec4(1.0, 2.0 / 3.0, 1.0 / 3.0, 3.0);
+    vec3 p = abs(fract(c.xxx + K.xyz) * 6.0 - K.www);
+    return c.z * mix(K.xxx, clamp(p - K.xxx, 0.0, 1.0), c.y);
+}
+
+void main() {
+    vec2 v = textureLod(flow_in, uv, 0).xy;
+    float r = length(v);
+    float angle = atan(v.y, v.x);
+    angle = angle / 2 / pi;
+
+    vec3 hsv = vec3(angle, 1.0, clamp(r, 0, 1));
+    vec3 rgb = hsv2rgb(hsv);
+
+    color_out = vec4(rgb, 1.0);
+    data_out = vec4(v.x, v.y, r, angle);
+}
@@ -0,0 +1,14 @@
+#version 330 core
+
+uniform sampler2D scene;
+
+in vec2 uv;
+out vec4 color_0;
+
+float rgb2gray(vec3 v) {
+    return (v.x + v.y + v.z) / 3;
+}
+
+void main() {
+    color_0 = vec4(rgb2gray(textureLod(scene, uv, 0).rgb), 0.0, 0.0, 1.0);
+}
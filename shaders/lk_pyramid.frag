@@ -0,0 +1,54 @@
+#version 330 core
+const float epsilon = 0.000000001;
+
+uniform sampler2D image;
+uniform sampler2D image_previous;
+uniform sampler2D flow_in;
+uniform float flow_scale;
+uniform int width;
+uniform int height;
+uniform int radius;
+
+in vec2 uv;
+out vec4 flow_out;
+
+void main() {
+    // flow in texels of this level, flow_scale is 2 for the estimate of the coarser level and 0 at the coarsest one
+    vec2 tex_unit = vec2(1.0 / width, 1.0 / height);
+    // the coarsest level starts from zero without reading flow_in, 0 * NaN of an unwritten target would stay NaN
+    vec2 v = vec2(0.0);
+    if (flow_scale != 0.0) {
+        v = textureLod(flow_in, uv, 0).xy * flow_scale;
+    }
+
+    float m11 = 0;
+    float m12 = 0;
+    float m22 = 0;
+    float q1 = 0;
+    float q2 = 0;
+
+    for (int y = -radius; y <= radius; y++) {
+        for (int x = -radius; x <= radius; x++) {
+            vec2 p = uv + vec2(x, y) * tex_unit;
+            float value = textureLod(image_previous, p, 0).r;
+            float ix = 0.5 * (textureLod(image_previous, p + vec2(tex_unit.x, 0), 0).r - textureLod(image_previous, p - vec2(tex_unit.x, 0), 0).r);
+            float iy = 0.5 * (textureLod(image_previous, p + vec2(0, tex_unit.y), 0).r - textureLod(image_previous, p - vec2(0, tex_unit.y), 0).r);
+            // temporal difference against the current frame warped by the flow estimate
+            float it = textureLod(image, p + v * tex_unit, 0).r - value;
+
+            m11 += ix * ix;
+            m12 += ix * iy;
+            m22 += iy * iy;
+            q1 += ix * it;
+            q2 += iy * it;
+        }
+    }
+
+    vec2 dv = vec2(0);
+    float det = m11 * m22 - m12 * m12;
+    if (det > epsilon) {
+        dv = -vec2(m22 * q1 - m12 * q2, m11 * q2 - m12 * q1) / det;
+    }
+
+    flow_out = vec4(v + dv, 0.0, 1.0);
+}
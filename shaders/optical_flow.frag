@@ -8,34 +8,19 @@ const float k[9] = float[](1, 2, 1, 2, 4, 2, 1, 2, 1);
 //const float k[9] = float[](-1, -1, -1, -1, 8, -1, -1, -1, -1);
 //const float k[9] = float[](-1, -2, -1, 0, 0, 0, +1, +2, +1);
 
-uniform sampler2D gradient_t;
-uniform sampler2D gradient_s_x;
-uniform sampler2D gradient_s_y;
+uniform sampler2D tensor;
+uniform sampler2D mismatch;
+
+#ifdef LAYERED
+// the window positions are computed here, the layered pipeline shares the passthrough vertex shader
 uniform int width;
 uniform int height;
-
+in vec2 uv;
+#else
 in vec2 uvs[filter_size * filter_size];
+#endif
 out vec4 color_out, data_out;
 
-vec3 scale_back(vec3 gradient) {
-    return (gradient * 2.0 - 1.0);
-}
-
-float rgb2gray(vec3 v) {
-    return (v.x + v.y + v.z) / 3;
-}
-
-float valueFromTexture(sampler2D texture, vec2 uv, float lod) {
-    vec2 tex_unit = vec2(1.0/width, 1.0/height);
-    vec3 color = scale_back(textureLod(texture, uv, lod).rgb);
-    color += scale_back(textureLod(texture, uv + vec2(-1, 0) * tex_unit, lod).rgb);
-    color += scale_back(textureLod(texture, uv + vec2(1, 0) * tex_unit, lod).rgb);
-    color += scale_back(textureLod(texture, uv + vec2(0, -1) * tex_unit, lod).rgb);
-    color += scale_back(textureLod(texture, uv + vec2(0, 1) * tex_unit, lod).rgb);
-
-    return rgb2gray(color/5);
-}
-
 vec3 hsv2rgb(vec3 c)
 {
     vec4 K = vec4(1.0, 2.0 / 3.0, 1.0 / 3.0, 3.0);
@@ -53,13 +38,23 @@ void main() {
     float q1 = 0;
     float q2 = 0;
 
-    for (int i = 0; i < filter_size * filter_size; i++) {
-        m11 += valueFromTexture(gradient_s_x, uvs[i], lod) * valueFromTexture(gradient_s_x, uvs[i], lod) * k[i];
-        m12 += valueFromTexture(gradient_s_x, uvs[i], lod) * valueFromTexture(gradient_s_y, uvs[i], lod) * k[i];
-        m22 += valueFromTexture(gradient_s_y, uvs[i], lod) * valueFromTexture(gradient_s_y, uvs[i], lod) * k[i];
+#ifdef LAYERED
+    vec2 uvs[filter_size * filter_size];
+    for (int y = -1; y <= 1; y++) {
+        for (int x = -1; x <= 1; x++) {
+            uvs[(y + 1) * filter_size + (x + 1)] = uv + vec2(x, y) * vec2(1.0 / width, 1.0 / height) * 3;
+        }
+    }
+#endif
 
-        q1 += valueFromTexture(gradient_t, uvs[i], lod) * valueFromTexture(gradient_s_x, uvs[i], lod) * k[i];
-        q2 += valueFromTexture(gradient_t, uvs[i], lod) * valueFromTexture(gradient_s_y, uvs[i], lod) * k[i];
+    for (int i = 0; i < filter_size * filter_size; i++) {
+        vec3 m = textureLod(tensor, uvs[i], lod).xyz * k[i];
+        vec2 q = textureLod(mismatch, uvs[i], lod).xy * k[i];
+        m11 += m.x;
+        m12 += m.y;
+        m22 += m.z;
+        q1 += q.x;
+        q2 += q.y;
 
         k_sum += k[i];
     }
@@ -7,7 +7,10 @@ const int filter_size = 3;
 
 uniform int width;
 uniform int height;
-uniform mat4 modelMatrix;
+// per draw transform, bound from the shared uniform buffer
+layout (std140) uniform Transform {
+    mat4 modelMatrix;
+};
 
 out vec2 uvs[filter_size * filter_size];
 
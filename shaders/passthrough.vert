@@ -3,12 +3,25 @@
 layout (location = 0) in vec3 position_in;
 layout (location = 1) in vec2 uv_in;
 
-uniform mat4 modelMatrix;
+// per draw transform, bound from the shared uniform buffer
+layout (std140) uniform Transform {
+    mat4 modelMatrix;
+};
 
+#ifdef LAYERED
+// one instance per layer, the geometry shader routes its triangles to that layer
+out vec2 uv_vertex;
+flat out int layer_vertex;
+#define uv uv_vertex
+#else
 out vec2 uv;
+#endif
 
 void main() {
     gl_Position = modelMatrix * vec4(position_in, 1.0);
     //gl_Position = vec4(position_in, 1.0);
     uv = uv_in;
+#ifdef LAYERED
+    layer_vertex = gl_InstanceID;
+#endif
 }
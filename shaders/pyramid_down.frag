@@ -0,0 +1,21 @@
+#version 330 core
+
+uniform sampler2D scene;
+uniform int width;
+uniform int height;
+
+in vec2 uv;
+out vec4 color_0;
+
+void main() {
+    // width and height of the finer level, four bilinear taps form a 4x4 binomial [1 3 3 1] kernel
+    vec2 tex_unit = vec2(1.0 / width, 1.0 / height);
+    float value = 0;
+    for (int y = -1; y <= 1; y += 2) {
+        for (int x = -1; x <= 1; x += 2) {
+            value += textureLod(scene, uv + vec2(x, y) * 0.75 * tex_unit, 0).r;
+        }
+    }
+
+    color_0 = vec4(value / 4, 0.0, 0.0, 1.0);
+}
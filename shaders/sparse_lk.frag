@@ -0,0 +1,70 @@
+#version 330 core
+const float epsilon = 0.000000001;
+// largest supported window, radius 7
+const int window_size = 15;
+
+uniform sampler2D image;
+uniform sampler2D image_previous;
+uniform sampler2D points;
+uniform int width;
+uniform int height;
+uniform int radius;
+uniform int iterations;
+
+out vec4 flow_out;
+
+float gray(sampler2D image, vec2 p) {
+    vec3 v = textureLod(image, p / vec2(width, height), 0).rgb;
+    return (v.x + v.y + v.z) / 3;
+}
+
+void main() {
+    // one fragment per tracked point, its position in pixels is stored at the same texel
+    vec2 point = texelFetch(points, ivec2(gl_FragCoord.xy), 0).xy;
+
+    // the previous frame and its gradients around the point do not change over the iterations
+    float previous[window_size * window_size];
+    vec2 gradients[window_size * window_size];
+    float m11 = 0;
+    float m12 = 0;
+    float m22 = 0;
+    int i = 0;
+    for (int y = -radius; y <= radius; y++) {
+        for (int x = -radius; x <= radius; x++) {
+            vec2 p = point + vec2(x, y);
+            float ix = 0.5 * (gray(image_previous, p + vec2(1, 0)) - gray(image_previous, p - vec2(1, 0)));
+            float iy = 0.5 * (gray(image_previous, p + vec2(0, 1)) - gray(image_previous, p - vec2(0, 1)));
+            previous[i] = gray(image_previous, p);
+            gradients[i] = vec2(ix, iy);
+            m11 += ix * ix;
+            m12 += ix * iy;
+            m22 += iy * iy;
+            i++;
+        }
+    }
+
+    vec2 v = vec2(0);
+    float residual = 0;
+    float det = m11 * m22 - m12 * m12;
+    if (det > epsilon) {
+        for (int iteration = 0; iteration < iterations; iteration++) {
+            vec2 q = vec2(0);
+            residual = 0;
+            i = 0;
+            for (int y = -radius; y <= radius; y++) {
+                for (int x = -radius; x <= radius; x++) {
+                    // temporal difference against the current frame warped by the estimate
+                    float it = gray(image, point + vec2(x, y) + v) - previous[i];
+                    q += gradients[i] * it;
+                    residual += it * it;
+                    i++;
+                }
+            }
+            v -= vec2(m22 * q.x - m12 * q.y, m11 * q.y - m12 * q.x) / det;
+        }
+    }
+
+    // displacement in pixels, rms intensity residual, 1 if the window has enough texture to be solved
+    float size = float((2 * radius + 1) * (2 * radius + 1));
+    flow_out = vec4(v, sqrt(residual / size), det > epsilon ? 1.0 : 0.0);
+}
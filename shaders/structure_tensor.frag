@@ -0,0 +1,33 @@
+#version 330 core
+
+uniform sampler2D gradient_t;
+uniform sampler2D gradient_s;
+uniform int width;
+uniform int height;
+
+in vec2 uv;
+out vec4 tensor_out, mismatch_out;
+
+vec3 valueFromTexture(vec2 uv, float lod) {
+    vec2 tex_unit = vec2(1.0/width, 1.0/height);
+    vec2 offsets[5] = vec2[](vec2(0, 0), vec2(-1, 0), vec2(1, 0), vec2(0, -1), vec2(0, 1));
+
+    vec3 value = vec3(0);
+    for (int i = 0; i < 5; i++) {
+        vec2 p = uv + offsets[i] * tex_unit;
+        value += vec3(textureLod(gradient_s, p, lod).xy, textureLod(gradient_t, p, lod).x);
+    }
+    return value / 5;
+}
+
+void main() {
+    float lod = 0;
+    vec3 gradient = valueFromTexture(uv, lod);
+    float ix = gradient.x;
+    float iy = gradient.y;
+    float it = gradient.z;
+
+    // products of the smoothed gradients, summed up by the optical flow pass
+    tensor_out = vec4(ix * ix, ix * iy, iy * iy, 0.0);
+    mismatch_out = vec4(ix * it, iy * it, 0.0, 0.0);
+}
@@ -0,0 +1,23 @@
+#version 330 core
+
+layout (location = 0) in vec4 track_in;
+
+uniform int width;
+uniform int height;
+
+out vec3 color;
+
+vec3 hsv2rgb(vec3 c)
+{
+    vec4 K = vec4(1.0, 2.0 / 3.0, 1.0 / 3.0, 3.0);
+    vec3 p = abs(fract(c.xxx + K.xyz) * 6.0 - K.www);
+    return c.z * mix(K.xxx, clamp(p - K.xxx, 0.0, 1.0), c.y);
+}
+
+void main() {
+    // position and displacement of a tracked point in pixels, colored like the dense flow
+    gl_Position = vec4(track_in.xy / vec2(width, height) * 2.0 - 1.0, 0.0, 1.0);
+    float r = length(track_in.zw);
+    float angle = atan(track_in.w, track_in.z) / 2 / 3.1415926535897932384626433832795;
+    color = hsv2rgb(vec3(angle, 1.0, clamp(r, 0.25, 1.0)));
+}
@@ -0,0 +1,85 @@
+import os
+import sys
+from contextlib import redirect_stdout
+
+# offscreen like the benchmark, tests that render are skipped where no EGL display is available
+os.environ.setdefault('PYOPENGL_PLATFORM', 'egl')
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+import numpy as np
+import pytest
+import matplotlib.pyplot as plt
+
+
+def eglAvailable():
+    try:
+        from OpenGL import EGL
+        os.environ.setdefault('EGL_PLATFORM', 'surfaceless')
+        display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        return bool(display) and bool(EGL.eglInitialize(display, None, None))
+    except Exception:
+        return False
+
+
+requiresEGL = pytest.mark.skipif(not eglAvailable(), reason='no EGL display')
+
+
+def texture(width, height, scale=6.0, seed=0):
+    # white noise low pass filtered with a Gaussian of scale pixels, periodic so rolling it has no seams
+    noise = np.random.default_rng(seed).random((height, width))
+    fy = np.fft.fftfreq(height)[:, None]
+    fx = np.fft.fftfreq(width)[None, :]
+    image = np.real(np.fft.ifft2(np.fft.fft2(noise) * np.exp(-2 * np.pi ** 2 * scale ** 2 * (fx * fx + fy * fy))))
+    return (image - image.min()) / (image.max() - image.min())
+
+
+def writeTranslation(path, width, height, frames, velocity, scale=6.0, seed=0):
+    # frame i is the texture moved by i * velocity whole pixels, x to the right and y downwards in the image
+    image = texture(width, height, scale, seed)
+    os.makedirs(path, exist_ok=True)
+    for i in range(frames):
+        shift = (velocity[1] * i, velocity[0] * i)
+        plt.imsave(os.path.join(path, 'frame_%06d.png' % i), np.roll(image, shift, (0, 1)), cmap='gray', vmin=0, vmax=1)
+    return path
+
+
+def readFrames(path, count):
+    from main import Data
+    data = Data(path)
+    frames = [data.nextFrame().copy() for i in range(count)]
+    data.close()
+    return np.stack(frames)
+
+
+def createProgram(*argv):
+    # shaders and meshes are loaded relative to the repository
+    from main import Program
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            return Program(['main.py'] + [str(arg) for arg in argv])
+    finally:
+        os.chdir(cwd)
+
+
+def runMain(*argv):
+    # the command line entry point in its own interpreter, like a user would start it
+    import subprocess
+    result = subprocess.run([sys.executable, os.path.join(root, 'main.py')] + [str(arg) for arg in argv], cwd=root,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    return result
+
+
+def textureData(framebuffer, attachment=0):
+    return framebuffer.color_buffer_textures[attachment].getBuffer()
+
+
+def smallerEigenvalue(m11, m12, m22):
+    # of the tensor summed over the Lucas Kanade window, small where the solve is ill-conditioned
+    from NumpyFlow import correlate2d, lucasKanadeKernel, lucasKanadeDilation
+    kernel = lucasKanadeKernel / lucasKanadeKernel.sum()
+    m11, m12, m22 = [correlate2d(m[None], kernel, lucasKanadeDilation)[0] for m in (m11, m12, m22)]
+    return (m11 + m22) / 2 - np.sqrt(((m11 - m22) / 2) ** 2 + m12 ** 2)
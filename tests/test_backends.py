@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from synthetic import requiresEGL, writeTranslation, readFrames, createProgram, textureData, smallerEigenvalue
+from TemporalGradient import temporalWeights
+from NumpyFlow import (gray, gaussianBlur, spatialGradients, temporalGradient, structureTensor, lucasKanade,
+                       mipmapSmooth, opticalFlow)
+
+
+def renderStages(path, *options):
+    # the targets of every stage after the flow of the second frame
+    program = createProgram('--images', path, '--headless', *options)
+    assert program.render()
+    graph = program.graph
+    stages = {
+        'gaussian': textureData(program.history.get(0)),
+        'gradient_t': textureData(graph.framebuffer('gradient_t')),
+        'gradient_s': textureData(graph.framebuffer('gradient_s')),
+        'tensor': textureData(graph.framebuffer('structure_tensor'), 0),
+        'mismatch': textureData(graph.framebuffer('structure_tensor'), 1),
+        'flow': textureData(graph.framebuffer('optical_flow'), 1),
+        'smooth': textureData(graph.framebuffer('optical_flow_smooth'), 1),
+    }
+    program.data.close()
+    return stages
+
+
+@requiresEGL
+@pytest.mark.parametrize('window', [2, 3, 4])
+def test_stages_match_numpy(tmp_path, window):
+    # the sizes are whole 16x16 blocks, so neither backend pads the frames
+    writeTranslation(str(tmp_path), 64, 48, 3, (2, 1))
+    stages = renderStages(str(tmp_path), '--sigma', 1.5, '--temporal-window', window)
+
+    # the history of the shaders starts with copies of the first frame
+    frames = readFrames(str(tmp_path), 2)
+    image = gaussianBlur(gray(frames[[0] * (window - 1) + [1]]), 1.5)
+    it = temporalGradient(image, window)
+    ix, iy = spatialGradients(image[window - 1:])
+    m11, m12, m22, q1, q2 = structureTensor(ix, iy, it)
+
+    # both blur passes store half floats, whose spacing is 2^-11 for the blurred values in [0.5, 1),
+    # the gradients add up the errors of the blurred frames with the weights of their differences
+    blur = 4 * 2.0 ** -11
+    np.testing.assert_allclose(stages['gaussian'][..., :3].mean(axis=-1), image[-1], atol=blur)
+    temporal = np.abs(temporalWeights(window)).sum() * blur
+    np.testing.assert_allclose(stages['gradient_t'][..., 0], it[0], atol=temporal)
+    np.testing.assert_allclose(stages['gradient_s'][..., 0], ix[0], atol=blur)
+    np.testing.assert_allclose(stages['gradient_s'][..., 1], iy[0], atol=blur)
+    # products of two gradients, each off by at most the temporal tolerance
+    scale = max(np.abs(ix).max(), np.abs(iy).max(), np.abs(it).max())
+    tensor, mismatch = stages['tensor'], stages['mismatch']
+    for gl, reference in zip([tensor[..., 0], tensor[..., 1], tensor[..., 2], mismatch[..., 0], mismatch[..., 1]],
+                             [m11, m12, m22, q1, q2]):
+        np.testing.assert_allclose(gl, reference[0], atol=2 * scale * temporal)
+
+
+@requiresEGL
+def test_lucas_kanade_and_smoothing_match_numpy(tmp_path):
+    writeTranslation(str(tmp_path), 128, 96, 3, (3, 1))
+    stages = renderStages(str(tmp_path), '--sigma', 2.0)
+    tensor, mismatch, flow, smooth = stages['tensor'], stages['mismatch'], stages['flow'], stages['smooth']
+    assert np.isfinite(flow).all() and np.isfinite(smooth).all()
+
+    # the solve only agrees where the window is well-conditioned, elsewhere float rounding dominates
+    eigenvalue = smallerEigenvalue(tensor[..., 0], tensor[..., 1], tensor[..., 2])
+    conditioned = eigenvalue > 0.1 * eigenvalue.max()
+    assert conditioned.mean() > 0.1
+
+    # the Lucas Kanade stage on the tensor of the shaders, its result is stored as half floats
+    reference = lucasKanade(*[channel[None] for channel in (tensor[..., 0], tensor[..., 1], tensor[..., 2],
+                                                            mismatch[..., 0], mismatch[..., 1])])[0]
+    np.testing.assert_allclose(flow[conditioned][:, :2], reference[conditioned][:, :2], rtol=2.0 ** -9, atol=2.0 ** -9)
+
+    # the whole NumPy pipeline up to the solve, a few percent off through the half float gradients
+    frames = readFrames(str(tmp_path), 2)
+    numpy = opticalFlow(frames, 2.0, smooth=False)[0]
+    np.testing.assert_allclose(flow[conditioned][:, :2], numpy[conditioned][:, :2], rtol=0.05, atol=0.05)
+
+    # the smoothing stage on the flow of the shaders, every mipmap level rounds to half floats again and the
+    # bilinear weights of the texture unit are quantized, so the error scales with the magnitudes averaged into a texel
+    reference = mipmapSmooth(flow[None])[0]
+    tolerance = 2.0 ** -8 * mipmapSmooth(np.abs(flow[None]))[0] + 2.0 ** -11
+    assert np.all(np.abs(smooth[..., :2] - reference[..., :2]) <= tolerance[..., :2])
+
+
+@requiresEGL
+def test_translation_is_recovered(tmp_path):
+    # a texture moved by 3 pixels to the right and 1 down, in texture coordinates with y up the flow is (3, -1);
+    # single scale Lucas Kanade underestimates a motion of several pixels a little
+    writeTranslation(str(tmp_path), 128, 96, 3, (3, 1))
+    expected = np.array([3.0, -1.0])
+    frames = readFrames(str(tmp_path), 2)
+    numpy = opticalFlow(frames, 2.0)[0]
+    gl = renderStages(str(tmp_path), '--sigma', 2.0)['smooth']
+    # the border clamps to the edge and does not move
+    for flow in (numpy, gl):
+        median = np.median(flow[16:-16, 16:-16, :2].reshape(-1, 2), axis=0)
+        np.testing.assert_allclose(median, expected, atol=0.25)
@@ -0,0 +1,31 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from synthetic import requiresEGL, writeTranslation, runMain
+from main import BatchData
+
+
+def test_mismatched_sizes_start_no_decoders(tmp_path):
+    first = writeTranslation(str(tmp_path / 'first'), 64, 48, 2, (1, 0))
+    second = writeTranslation(str(tmp_path / 'second'), 80, 48, 2, (1, 0))
+    with pytest.raises(ValueError):
+        BatchData([first, second])
+    assert not multiprocessing.active_children()
+
+
+@requiresEGL
+def test_batch_matches_single_runs(tmp_path):
+    # two layers with different motions and lengths, the batch is cut to the shorter input
+    first = writeTranslation(str(tmp_path / 'first'), 80, 48, 4, (2, 1))
+    second = writeTranslation(str(tmp_path / 'second'), 80, 48, 3, (-1, 2), seed=1)
+    runMain('--images', first, second, '--headless', '--output', str(tmp_path / 'flow.npy'))
+    for stream, images in enumerate([first, second]):
+        single = str(tmp_path / ('single_%d.npy' % stream))
+        runMain('--images', images, '--headless', '--stop', 3, '--output', single)
+        batched = np.load(str(tmp_path / ('flow_%03d.npy' % stream)))
+        assert batched.shape == (2, 48, 80, 4)
+        # the layered shader computes the window positions per fragment instead of interpolating them, the solve
+        # amplifies that rounding where the window is degenerate, and the smoothing averages it into a few half float ulps
+        np.testing.assert_allclose(batched, np.load(single), rtol=2.0 ** -8, atol=2.0 ** -11)
@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+import pytest
+
+from synthetic import requiresEGL, writeTranslation, createProgram, textureData
+from GLContext import ProgramCache
+
+
+def renderFlow(path, cache):
+    program = createProgram('--images', path, '--headless', '--shader-cache', cache)
+    assert program.render()
+    flow = textureData(program.graph.framebuffer(program.result), 1)
+    binaries = program.context.programs.binaries
+    program.data.close()
+    return flow, binaries
+
+
+@requiresEGL
+def test_warm_start_loads_binaries(tmp_path, monkeypatch):
+    images = writeTranslation(str(tmp_path / 'images'), 64, 48, 2, (2, 1))
+    cache = str(tmp_path / 'cache')
+    cold, binaries = renderFlow(images, cache)
+    if not binaries:
+        pytest.skip('the driver has no program binary formats')
+    stored = sorted(os.listdir(cache))
+    assert stored and all(name.endswith('.bin') for name in stored)
+
+    # every program of the warm start comes from the cache, none is compiled again
+    def link(self, *sources):
+        raise AssertionError('program compiled on a warm start')
+    monkeypatch.setattr(ProgramCache, 'link', link)
+    warm, binaries = renderFlow(images, cache)
+    assert sorted(os.listdir(cache)) == stored
+    np.testing.assert_array_equal(warm, cold)
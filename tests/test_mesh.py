@@ -0,0 +1,20 @@
+import numpy as np
+
+import synthetic
+from GLContext import Mesh
+
+
+def test_rows_of_mixed_length(tmp_path):
+    # the third vertex carries a color, it must not shift the following values into other vertices
+    path = tmp_path / 'triangle.obj'
+    path.write_text('v 1 2 3\nv 4 5 6\nv 7 8 9 .5 .5 .5\nvt 0 0\nvt 1 0 0\nvt 0 1\nf 1/1 2/2 3/3\n')
+    vboData, indices = Mesh.parse(str(path))
+    np.testing.assert_array_equal(vboData[:, :3], [[1, 2, 3], [4, 5, 6], [7, 8, 9]])
+    np.testing.assert_array_equal(vboData[:, 3:5], [[0, 0], [1, 0], [0, 1]])
+    np.testing.assert_array_equal(indices, [0, 1, 2])
+
+
+def test_quad_mesh():
+    vboData, indices = Mesh.parse(synthetic.root + '/meshes/quad_uv.obj')
+    assert len(indices) % 3 == 0 and indices.max() < len(vboData)
+    np.testing.assert_array_equal(np.unique(vboData[:, 3:5]), [0, 1])
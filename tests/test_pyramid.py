@@ -0,0 +1,15 @@
+import numpy as np
+
+from synthetic import requiresEGL, writeTranslation, runMain
+
+
+@requiresEGL
+def test_pyramid_recovers_large_translation(tmp_path):
+    # 6 pixels are beyond the reach of the single scale window, the coarse to fine estimate is written unsmoothed
+    images = writeTranslation(str(tmp_path / 'images'), 128, 96, 3, (6, 2))
+    runMain('--images', images, '--headless', '--flow', 'pyramid', '--output', tmp_path / 'flow.npy')
+    flow = np.load(tmp_path / 'flow.npy')
+    assert flow.shape == (2, 96, 128, 4) and np.isfinite(flow).all()
+    # the border clamps to the edge and does not move
+    error = np.abs(flow[:, 16:-16, 16:-16, :2] - [6.0, 2.0])
+    assert np.percentile(error, 90) < 0.05
@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+
+from synthetic import requiresEGL, writeTranslation, runMain
+
+
+@requiresEGL
+@pytest.mark.parametrize('window', [2, 3])
+def test_shards_match_a_single_run(tmp_path, window):
+    # the second shard loads the frames its first flows need into the history, so the merged output is exact
+    images = writeTranslation(str(tmp_path / 'images'), 64, 48, 7, (2, 1))
+    single = str(tmp_path / 'single.npy')
+    sharded = str(tmp_path / 'sharded.npy')
+    runMain('--images', images, '--headless', '--temporal-window', window, '--output', single)
+    runMain('--images', images, '--headless', '--temporal-window', window, '--shards', 2, '--output', sharded)
+    assert np.load(sharded).shape == (6, 48, 64, 4)
+    np.testing.assert_array_equal(np.load(sharded), np.load(single))
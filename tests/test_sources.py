@@ -0,0 +1,140 @@
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+from synthetic import texture
+import FrameSource
+from FrameSource import createFrameSource, FrameDecoder, FfmpegSource, ImageioSource
+from FlowWriter import truncateNpy
+from main import Data
+
+hasFfmpeg = bool(shutil.which('ffmpeg') and shutil.which('ffprobe'))
+try:
+    import imageio
+    import imageio_ffmpeg
+    hasImageio = True
+except ImportError:
+    hasImageio = False
+
+
+def writeVideo(path, width=64, height=48, frames=48, fps=24):
+    # a texture moving one pixel per frame, with keyframes every 10 frames so seeking lands between them
+    image = (texture(width, height) * 255).astype(np.uint8)
+    video = np.stack([np.repeat(np.roll(image, i, 1)[:, :, None], 3, 2) for i in range(frames)])
+    if hasFfmpeg:
+        subprocess.run(['ffmpeg', '-v', 'error', '-y', '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '%dx%d' % (width, height),
+                        '-r', str(fps), '-i', '-', '-g', '10', '-pix_fmt', 'yuv420p', path], input=video.tobytes(), check=True)
+    else:
+        imageio.mimwrite(path, video, fps=fps, macro_block_size=16)
+    return path
+
+
+@pytest.fixture(params=['ffmpeg', 'imageio'])
+def backend(request, monkeypatch):
+    # the imageio source is only chosen without ffmpeg on the path, the decoder processes are forked and see the patch
+    if request.param == 'ffmpeg' and not hasFfmpeg:
+        pytest.skip('no ffmpeg and ffprobe on the path')
+    if request.param == 'imageio':
+        if not hasImageio:
+            pytest.skip('no imageio with the ffmpeg plugin')
+        monkeypatch.setattr(FrameSource.shutil, 'which', lambda name: None)
+    return {'ffmpeg': FfmpegSource, 'imageio': ImageioSource}[request.param]
+
+
+@pytest.fixture
+def video(tmp_path):
+    if not (hasFfmpeg or hasImageio):
+        pytest.skip('no video encoder')
+    return writeVideo(str(tmp_path / 'video.mp4'))
+
+
+def readAll(source):
+    frames = []
+    out = np.empty((source.height, source.width, 3), dtype=np.uint8)
+    while source.read(len(frames), out):
+        frames.append(out.copy())
+    return np.stack(frames)
+
+
+def test_missing_path_is_reported(tmp_path):
+    path = str(tmp_path / 'missing.mp4')
+    with pytest.raises(FileNotFoundError):
+        createFrameSource(path)
+    # the traceback of the decoder process is raised again in the parent
+    decoder = FrameDecoder(path, range(2), (48, 64, 3), 2)
+    try:
+        with pytest.raises(RuntimeError, match='FileNotFoundError'):
+            decoder.get()
+    finally:
+        decoder.close()
+
+
+def test_truncate_npy(tmp_path):
+    path = str(tmp_path / 'flow.npy')
+    np.save(path, np.arange(20.0).reshape(5, 4))
+    truncateNpy(path, 3)
+    np.testing.assert_array_equal(np.load(path), np.arange(12.0).reshape(3, 4))
+    truncateNpy(path, 3)
+    assert np.load(path).shape == (3, 4)
+
+
+def test_seeking_matches_sequential_reads(backend, video):
+    source = createFrameSource(video)
+    assert isinstance(source, backend)
+    assert (source.width, source.height) == (64, 48)
+    reference = readAll(source)
+    source.close()
+    assert len(reference) == 48
+
+    # forward within the seek distance, backwards, a jump past it and on from there
+    source = createFrameSource(video)
+    out = np.empty_like(reference[0])
+    for index in [5, 7, 2, 2 + FfmpegSource.seekDistance + 5, 3 + FfmpegSource.seekDistance + 5]:
+        assert source.read(index, out)
+        np.testing.assert_array_equal(out, reference[index])
+    source.close()
+
+
+def test_start_and_stride(backend, video):
+    source = createFrameSource(video)
+    reference = readAll(source)
+    source.close()
+    data = Data(video, start=3, stop=30, stride=4)
+    frames = []
+    while not data.lastFrameReached:
+        frames.append(data.nextFrame().copy())
+    data.close()
+    np.testing.assert_array_equal(np.stack(frames), reference[3:30:4])
+
+
+def test_early_end_of_video(backend, video):
+    source = createFrameSource(video)
+    count = len(readAll(source))
+    # a frame count announced by the container that the stream does not reach
+    source.frameCount = count + 5
+    out = np.empty((source.height, source.width, 3), dtype=np.uint8)
+    assert not source.read(count + 1, out)
+    source.close()
+
+    decoder = FrameDecoder(video, range(count - 2, count + 3), (48, 64, 3), 2)
+    try:
+        for i in range(2):
+            slot, decodeTime = decoder.get()
+            decoder.release(slot)
+        assert decoder.get() is None
+    finally:
+        decoder.close()
+
+
+def test_decoder_forwards_tracebacks(backend, tmp_path):
+    path = str(tmp_path / 'broken.mp4')
+    with open(path, 'wb') as broken:
+        broken.write(b'not a video' * 100)
+    decoder = FrameDecoder(path, range(2), (48, 64, 3), 2)
+    try:
+        with pytest.raises(RuntimeError, match='Traceback'):
+            decoder.get()
+    finally:
+        decoder.close()
@@ -0,0 +1,27 @@
+import numpy as np
+
+from synthetic import requiresEGL, writeTranslation, runMain
+
+
+@requiresEGL
+def test_tracks_follow_a_translation(tmp_path):
+    # a texture moved by 3 pixels to the right and 1 down every frame, the tracks are in image coordinates
+    images = writeTranslation(str(tmp_path / 'images'), 128, 96, 4, (3, 1))
+    output = str(tmp_path / 'tracks.npy')
+    runMain('--images', images, '--headless', '--flow', 'sparse', '--points', 64, '--output', output)
+    tracks = np.load(output)
+    assert tracks.shape == (3, 64, 5)
+
+    # the corners are detected in the first flow frame and have no flow yet, later frames follow them
+    assert np.isfinite(tracks[0, :, 0]).sum() >= 32 and np.isnan(tracks[0, :, 2]).all()
+    for frame in tracks[1:]:
+        moving = np.isfinite(frame[:, 2])
+        assert moving.sum() >= 32
+        np.testing.assert_allclose(np.median(frame[moving, 2:4], axis=0), [3.0, 1.0], atol=0.05)
+
+    # a track keeps its id and moves by its flow from one frame to the next
+    previous, current = tracks[-2], tracks[-1]
+    for track in current[np.isfinite(current[:, 2])]:
+        match = previous[previous[:, 4] == track[4]]
+        if len(match):
+            np.testing.assert_allclose(track[:2] - match[0, :2], track[2:4], atol=1e-3)
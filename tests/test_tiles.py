@@ -0,0 +1,34 @@
+import numpy as np
+
+from synthetic import requiresEGL, writeTranslation, readFrames, createProgram, smallerEigenvalue
+from NumpyFlow import gray, gaussianBlur, padFrames, spatialGradients, temporalGradient, structureTensor
+
+
+def lucasKanadeStage(images, output, *options):
+    # the unsmoothed Lucas Kanade flow is written in place of the result
+    program = createProgram('--images', images, '--headless', '--sigma', 2.0, '--output', output, *options)
+    program.result = 'optical_flow'
+    program.run()
+    return np.load(output)
+
+
+@requiresEGL
+def test_tiles_match_the_whole_frame(tmp_path):
+    # neither side is a multiple of 16, so the tiles at the border clamp into the padding
+    images = writeTranslation(str(tmp_path / 'images'), 200, 136, 3, (3, 1))
+    whole = lucasKanadeStage(images, str(tmp_path / 'whole.npy'))
+    tiled = lucasKanadeStage(images, str(tmp_path / 'tiled.npy'), '--tile', 128)
+    assert whole.shape == tiled.shape == (2, 136, 200, 4)
+
+    # a tile blurs the same pixels, its tensor differs from the whole frame by the rounding of the texture coordinates
+    # and the solve amplifies that where the window is ill-conditioned, so only the well-conditioned texels are compared
+    image = gaussianBlur(padFrames(gray(readFrames(images, 3))), 2.0)
+    ix, iy = spatialGradients(image[1:])
+    m11, m12, m22, q1, q2 = structureTensor(ix, iy, temporalGradient(image))
+    for frame in range(2):
+        # the outputs have their rows in image order
+        eigenvalue = smallerEigenvalue(m11[frame], m12[frame], m22[frame])[:136, :200][::-1]
+        conditioned = eigenvalue > 0.1 * eigenvalue.max()
+        assert conditioned.mean() > 0.1
+        np.testing.assert_allclose(tiled[frame][conditioned][:, :2], whole[frame][conditioned][:, :2],
+                                   rtol=2.0 ** -7, atol=2.0 ** -7)
@@ -0,0 +1,26 @@
+import os
+import numpy as np
+
+from synthetic import requiresEGL, writeTranslation, runMain
+from FlowWriter import FLO_TAG
+
+
+@requiresEGL
+def test_outputs_use_image_coordinates(tmp_path):
+    # moved 3 pixels to the right and 1 down, every output format reports (3, 1) with y pointing down
+    images = writeTranslation(str(tmp_path / 'images'), 128, 96, 3, (3, 1))
+    runMain('--images', images, '--headless', '--sigma', 2.0, '--output', tmp_path / 'flow.npy')
+    runMain('--images', images, '--headless', '--sigma', 2.0, '--output', tmp_path / 'flo')
+    flow = np.load(tmp_path / 'flow.npy')
+    assert flow.shape == (2, 96, 128, 4)
+    median = np.median(flow[:, 16:-16, 16:-16, :2].reshape(-1, 2), axis=0)
+    np.testing.assert_allclose(median, [3.0, 1.0], atol=0.25)
+    # the angle follows the mirrored vy, the smoothing averages angles too
+    angle = np.median(flow[:, 16:-16, 16:-16, 3])
+    np.testing.assert_allclose(angle, np.arctan2(1.0, 3.0) / 2 / np.pi, atol=0.02)
+
+    with open(os.path.join(tmp_path, 'flo', 'frame_000000.flo'), 'rb') as floFile:
+        assert np.frombuffer(floFile.read(4), '<f4')[0] == np.float32(FLO_TAG)
+        width, height = np.frombuffer(floFile.read(8), '<i4')
+        uv = np.frombuffer(floFile.read(), '<f4').reshape(height, width, 2)
+    np.testing.assert_allclose(uv, flow[0, ..., :2], atol=1e-6)